@@ -1,3 +1,8 @@
 from .train import Train
 from .eval import Eval
-from .infer import Infer, Slide_Infer
\ No newline at end of file
+from .infer import Infer, Slide_Infer, Merge_Infer
+from .export import Export
+from .predictor import Predictor
+from .quant import Quant
+from .distributed import Distributed_Train
+from .cascade import DiffGate, ModelGate, Calibrate_Gate
\ No newline at end of file
@@ -0,0 +1,75 @@
+import os
+import time
+import multiprocessing
+import paddle
+from visualdl import LogWriter
+from ppcd.core.eval import Eval, log_eval
+
+
+def eval_worker(model_fn, eval_data, logdir, losses, threshold, amp, device, wait_time, queue):
+    if device is not None:
+        paddle.set_device(device)
+    model = model_fn()
+    file_name = 'vdlrecords.' + str(int(time.time())) + '.eval.log'
+    with LogWriter(logdir=logdir, file_name=file_name) as writer:
+        while True:
+            task = queue.get()
+            if task is None:
+                break
+            params_path, epoch_id, step = task
+            # 等待参数文件写完
+            start = time.time()
+            while not os.path.exists(params_path):
+                if time.time() - start > wait_time:
+                    break
+                time.sleep(0.5)
+            if not os.path.exists(params_path):
+                print('[AsyncEval] can\'t find {}, skip it.'.format(params_path))
+                continue
+            model.set_dict(paddle.load(params_path))
+            eval_result = Eval(
+                model=model,
+                eval_data=eval_data,
+                losses=losses,
+                threshold=threshold,
+                show_result=False,
+                amp=amp
+            )
+            log_eval(writer, eval_result, epoch_id, step)
+
+
+class AsyncEval(object):
+    """
+    在后台进程中对保存的参数进行评估，训练不需要等待评估结束，结果写入同一个VisualDL日志文件夹
+    后台进程通过spawn启动（fork时CUDA和线程池已经初始化，子进程会出错或死锁），
+    在子进程中由model_fn重新构建网络，每次评估前加载保存的.pdparams，
+    因此model_fn、eval_data和losses需要可以pickle，训练脚本需要放在 if __name__ == '__main__': 下
+    Args:
+        model_fn (callable): 构建网络的函数（不需要参数），如functools.partial(UNet, in_channels=6)
+        eval_data (CDataset/BDataset): 评估数据
+        logdir (str): VisualDL日志文件夹
+        losses (dict/None): 损失的配置，默认为None
+        threshold (float): 单通道输出时的阈值，默认为0.5
+        amp (str/None): 混合精度，默认为None
+        device (str/None): 子进程的设备，如'cpu'、'gpu:1'，为None时使用paddle的默认设备，默认为None
+        wait_time (int): 等待参数文件写入的最长秒数，默认为600
+    """
+    def __init__(self, model_fn, eval_data, logdir, losses=None, threshold=0.5, amp=None, \
+                 device=None, wait_time=600):
+        if not callable(model_fn):
+            raise ValueError('model_fn should be callable that builds the network.')
+        ctx = multiprocessing.get_context('spawn')
+        self.queue = ctx.Queue()
+        self.process = ctx.Process(
+            target=eval_worker,
+            args=(model_fn, eval_data, logdir, losses, threshold, amp, device, wait_time, self.queue),
+            daemon=True)
+        self.process.start()
+
+    def submit(self, params_path, epoch_id, step):
+        self.queue.put((params_path, epoch_id, step))
+
+    def close(self):
+        # 等待已提交的评估全部完成
+        self.queue.put(None)
+        self.process.join()
@@ -0,0 +1,147 @@
+import time
+import numpy as np
+import paddle
+import paddle.nn.functional as F
+from prettytable import PrettyTable
+from tqdm import tqdm
+from ppcd.datasets import DataLoader
+from ppcd.utils import auto_cast
+from ppcd.core.infer import load_model
+
+
+def tile_stat(values, stat):
+    # values: [N, P]
+    if stat == 'mean':
+        return np.mean(values, axis=1)
+    elif stat == 'max':
+        return np.max(values, axis=1)
+    else:
+        return np.percentile(values, 99, axis=1)
+
+
+class DiffGate(object):
+    """
+    基于两期差异强度（CVA的变化强度）的门控，计算量远小于网络
+    Args:
+        stat (str): 每块的统计量，可选参数为 ['mean', 'max', 'p99']，默认为'p99'
+        band_num (int/None): 参与计算的波段数，为None时使用全部波段，默认为None
+    """
+    stats = ['mean', 'max', 'p99']
+    def __init__(self, stat='p99', band_num=None):
+        assert stat in self.stats, 'stat should be one of {}.'.format(self.stats)
+        self.stat = stat
+        self.band_num = band_num
+
+    def __call__(self, imgs):
+        band_num = imgs[0].shape[1] if self.band_num is None else self.band_num
+        with paddle.no_grad():
+            diff = imgs[-1][:, :band_num].astype('float32') - imgs[0][:, :band_num].astype('float32')
+            mag = paddle.sqrt(paddle.sum(diff ** 2, axis=1))
+        return tile_stat(mag.numpy().reshape([mag.shape[0], -1]), self.stat)
+
+
+class ModelGate(object):
+    """
+    基于小模型（如FastSCNN）变化概率的门控
+    Args:
+        model (nn.Layer/Predictor): 门控模型
+        params_path (str/None): 模型参数路径，默认为None
+        stat (str): 每块变化概率的统计量，可选参数为 ['mean', 'max', 'p99']，默认为'max'
+        amp (str/None): 混合精度，默认为None
+    """
+    def __init__(self, model, params_path=None, stat='max', amp=None):
+        assert stat in DiffGate.stats, 'stat should be one of {}.'.format(DiffGate.stats)
+        load_model(model, params_path)
+        self.model = model
+        self.stat = stat
+        self.amp = amp
+
+    def __call__(self, imgs):
+        with paddle.no_grad(), auto_cast(self.amp):
+            pred = self.model(imgs)[0]
+        pred = pred.astype('float32')
+        num_class = pred.shape[1]
+        if num_class == 1:  # 单通道输出为变化概率
+            prob = pred[:, 0]
+        else:  # 多类时非0类均为变化
+            prob = 1. - F.softmax(pred, axis=1)[:, 0]
+        return tile_stat(prob.numpy().reshape([prob.shape[0], -1]), self.stat)
+
+
+def Calibrate_Gate(gate,
+                   eval_data,
+                   target_recall=0.99,
+                   model=None,
+                   amp=None,
+                   ignore_index=255,
+                   show_result=True):
+    '''
+        在带标签的数据上标定门控阈值，统计不同阈值下的召回率与计算量
+        Args:
+            gate (DiffGate/ModelGate): 门控
+            eval_data (CDataset/BDataset): 带标签的数据，BDataset需要为'slide'模式
+            target_recall (float): 需要保留的变化像素比例，默认为0.99
+            model (nn.Layer/Predictor/None): 大模型，提供时测量其耗时并计算相对计算量，默认为None
+            amp (str/None): 大模型测量耗时的混合精度，默认为None
+            ignore_index (int): 标签中忽略的值，默认为255
+            show_result (bool): 是否打印召回率与计算量的表，默认为True
+        Return：
+            threshold (float): 满足target_recall的最大阈值，分数小于阈值的块不进行预测
+    '''
+    eval_loader = DataLoader(eval_data, batch_size=1, is_val=True)
+    scores = []
+    pixels = []
+    gate_time = 0.
+    model_times = []
+    for val_load_data in tqdm(eval_loader):
+        if val_load_data is None:
+            break
+        val_img, val_lab = val_load_data
+        start = time.time()
+        scores.extend(list(gate(val_img)))
+        gate_time += time.time() - start
+        lab = val_lab[0].numpy()
+        for i in range(lab.shape[0]):
+            pixels.append(np.sum((lab[i] > 0) & (lab[i] != ignore_index)))
+        # 大模型的耗时取前10块的平均
+        if model is not None and len(model_times) < 10:
+            model.eval()
+            start = time.time()
+            with paddle.no_grad(), auto_cast(amp):
+                model(val_img)
+            model_times.append(time.time() - start)
+    scores = np.array(scores, dtype='float64')
+    pixels = np.array(pixels, dtype='float64')
+    changed = pixels > 0
+    if not changed.any():
+        raise ValueError('There is no changed tile in eval_data, can\'t calibrate the gate!')
+    gate_cost = gate_time / len(scores)
+    model_cost = np.mean(model_times[1:] if len(model_times) > 1 else model_times) \
+                 if model is not None else None
+
+    # 按分数从大到小累加变化像素，达到召回率时的分数即为阈值
+    def threshold_of(recall):
+        order = np.argsort(-scores[changed], kind='stable')
+        cum = np.cumsum(pixels[changed][order])
+        k = min(np.searchsorted(cum, recall * cum[-1] - 1e-9), len(cum) - 1)
+        return scores[changed][order][k]
+
+    table = PrettyTable(['target_recall', 'threshold', 'tile_recall', 'pixel_recall', 'pass_rate', 'rel_cost'])
+    for recall in sorted(set([0.9, 0.95, 0.99, 1.0, target_recall])):
+        thr = threshold_of(recall)
+        passed = scores >= thr
+        pass_rate = np.mean(passed)
+        if model_cost is not None:
+            rel_cost = '{:.4f}'.format((gate_cost + pass_rate * model_cost) / (model_cost + 1e-12))
+        else:
+            rel_cost = '{:.4f}'.format(pass_rate)
+        table.add_row([recall, '{:.6g}'.format(thr),
+                       '{:.4f}'.format(np.sum(passed & changed) / np.sum(changed)),
+                       '{:.4f}'.format(np.sum(pixels[passed]) / np.sum(pixels)),
+                       '{:.4f}'.format(pass_rate), rel_cost])
+    if show_result:
+        print('[Calibrate] tiles: {}, changed tiles: {}, gate time/tile: {:.4f}s{}'.format(
+            len(scores), int(np.sum(changed)), gate_cost,
+            ', model time/tile: {:.4f}s'.format(model_cost) if model_cost is not None else ''))
+        print(table)
+    return float(threshold_of(target_recall))
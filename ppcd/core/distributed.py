@@ -0,0 +1,25 @@
+import paddle.distributed as dist
+from ppcd.core.train import Train
+
+
+def train_worker(build_fn, sync_bn, train_kwargs):
+    dist.init_parallel_env()
+    # 每个进程单独构建模型、数据和优化器，避免在进程间传递模型
+    train_kwargs = dict(train_kwargs)
+    train_kwargs.update(build_fn())
+    Train(distributed=True, sync_bn=sync_bn, **train_kwargs)
+
+
+def Distributed_Train(build_fn, nprocs=2, backend='gloo', sync_bn=False, **train_kwargs):
+    '''
+        启动多个本地进程进行数据并行训练，每个进程读取不同的数据，梯度在进程间同步
+        Args:
+            build_fn (function): 模块级的函数（需要能被pickle），返回包含model、train_data、optimizer等
+                                 Train参数的dict，例如 {'model': model, 'train_data': train_data, 
+                                 'optimizer': opt, 'eval_data': eval_data, 'losses': losses}
+            nprocs (int): 进程数，默认为2
+            backend (str): 通信后端，CPU上使用'gloo'，GPU上可以使用'nccl'，默认为'gloo'
+            sync_bn (bool): 是否同步BN的统计量，GPU上使用SyncBatchNorm，CPU上在评估和保存前求平均，默认为False
+            train_kwargs: 其余传给Train的参数，如epoch、batch_size（每个进程的批大小）、save_model_path等
+    '''
+    dist.spawn(train_worker, args=(build_fn, sync_bn, train_kwargs), nprocs=nprocs, backend=backend)
@@ -3,7 +3,7 @@ import numpy as np
 import paddle
 from ppcd.datasets import DataLoader
 from ppcd.metrics import ComputAccuracy
-from ppcd.utils import loss_computation
+from ppcd.utils import loss_computation, auto_cast
 from tqdm import tqdm
 
 
@@ -13,7 +13,8 @@ def Eval(model,
          losses=None,
          threshold=0.5,
          ignore_index=255,
-         show_result=True):
+         show_result=True,
+         amp=None):
     dataloader = DataLoader
     data_lens = len(eval_data)
     model.eval()
@@ -34,7 +35,8 @@ def Eval(model,
         if val_load_data is None:
             break
         val_img, val_lab = val_load_data
-        val_pred_list = model(val_img)
+        with auto_cast(amp):
+            val_pred_list = model(val_img)
         tmp_pred = []
         tmp_lab = []
         # 没有变化区标签的就不评估
@@ -50,12 +52,14 @@ def Eval(model,
             continue
         # val_img = paddle.concat([val_A_img, val_B_img], axis=1)
         # val_pred_list = model(val_img)
-        val_loss_list = loss_computation(
-            logits_list=val_pred_list,
-            labels=val_lab,
-            losses=losses)
-        val_loss = sum(val_loss_list)
-        val_losses.append(val_loss.numpy())
+        # 不提供损失时（如静态图预测器）只计算精度
+        if losses is not None:
+            val_loss_list = loss_computation(
+                logits_list=val_pred_list,
+                labels=val_lab,
+                losses=losses)
+            val_loss = sum(val_loss_list)
+            val_losses.append(val_loss.numpy())
         num_class = val_pred_list[0].shape[1]  # eval_loader.classes_num
         if num_class != 1:
             val_pred = paddle.argmax(val_pred_list[0], axis=1, keepdim=True, \
@@ -75,6 +79,8 @@ def Eval(model,
     vcm = val_class_mious / data_lens
     vca = val_class_accs / data_lens
     vcf = val_class_f1s / data_lens
+    if val_losses == []:
+        val_losses = [0.]
     if show_result:
         print("[Eval] loss: {:.4f}, miou: {:.4f}, class_miou: {}, acc: {:.4f}, class_acc: {}, f1: {:.4f}, class_f1: {}, kappa: {:.4f}" \
                 .format(np.mean(val_losses), np.mean(val_mious), \
@@ -84,4 +90,18 @@ def Eval(model,
         return
     else:
         return np.mean(val_losses), np.mean(val_mious), vcm, np.mean(val_maccs), \
-               vca, np.mean(val_mf1s), vcf, np.mean(val_kappas)
\ No newline at end of file
+               vca, np.mean(val_mf1s), vcf, np.mean(val_kappas)
+
+# 打印评估结果并写入VisualDL
+def log_eval(writer, eval_result, epoch_id, step):
+    val_losses, val_mious, val_class_miou, val_maccs, val_class_acc, val_mf1s, val_class_f1, val_kappas = eval_result
+    print("[Eval] epoch: {}, loss: {:.4f}, miou: {:.4f}, class_miou: {}, acc: {:.4f}, class_acc: {}, f1: {:.4f}, class_f1: {}, kappa: {:.4f}" \
+          .format(epoch_id + 1, np.mean(val_losses), np.mean(val_mious), \
+          str(np.round(val_class_miou, 4)), np.mean(val_maccs), \
+          str(np.round(val_class_acc, 4)), np.mean(val_mf1s), \
+          str(np.round(val_class_f1, 4)), np.mean(val_kappas)))
+    writer.add_scalar(tag="eval/loss", step=step, value=np.mean(val_losses))
+    writer.add_scalar(tag="eval/acc", step=step, value=np.mean(val_maccs))
+    writer.add_scalar(tag="eval/miou", step=step, value=np.mean(val_mious))
+    writer.add_scalar(tag="eval/f1", step=step, value=np.mean(val_mf1s))
+    writer.add_scalar(tag="eval/kappa", step=step, value=np.mean(val_kappas))
\ No newline at end of file
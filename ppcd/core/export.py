@@ -0,0 +1,48 @@
+import os
+import paddle
+from paddle.static import InputSpec
+
+
+def Export(model,
+           params_path=None,
+           save_path=None,
+           num_image=2,
+           in_channels=3,
+           c_size=None):
+    '''
+        将动态图模型导出为静态图推理模型，导出后得到 model.pdmodel 和 model.pdiparams
+        Args:
+            model (nn.Layer): 需要导出的网络
+            params_path (str/None): 训练好的参数路径，为None时使用模型当前参数
+            save_path (str): 导出文件夹
+            num_image (int): 输入图像列表的张数（时段数），默认为2
+            in_channels (int/list): 每张图像的通道数，为list时与每张图像一一对应，默认为3
+            c_size (list/None): 输入块大小[H, W]，为None时导出动态形状，默认为None
+        Return：
+            model_path (str): 导出模型的路径前缀，可以直接用于Predictor
+    '''
+    if save_path is None:
+        raise ValueError('save_path can\'t be None!')
+    if not isinstance(in_channels, list):
+        in_channels = [in_channels] * num_image
+    if len(in_channels) != num_image:
+        raise ValueError('The length of in_channels should equal to num_image: {} != {}.'
+                         .format(len(in_channels), num_image))
+    if c_size is not None and len(c_size) != 2:
+        raise ValueError('c_size should include 2 elements, but it is {}.'.format(c_size))
+    if os.path.exists(save_path) == False:
+        os.makedirs(save_path)
+    if params_path is not None:
+        para_state_dict = paddle.load(params_path)
+        model.set_dict(para_state_dict)
+    model.eval()
+    H, W = c_size if c_size is not None else [None, None]
+    # 网络的输入为图像列表，因此InputSpec也需要为列表
+    input_spec = [[
+        InputSpec(shape=[None, in_channels[i], H, W], dtype='float32', name=('image_' + str(i)))
+        for i in range(num_image)
+    ]]
+    model_path = os.path.join(save_path, 'model')
+    paddle.jit.save(model, model_path, input_spec=input_spec)
+    print('[Export] model saved in: ' + save_path)
+    return model_path
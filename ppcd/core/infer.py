@@ -1,47 +1,138 @@
 import os
+import re
 import cv2
+from math import ceil, floor
+import numpy as np
 import paddle
 from tqdm import tqdm
-# from paddle.io import DataLoader
-from ppcd.datasets import DataLoader
-from ppcd.tools import splicing_list, save_tif
+from ppcd.datasets.datasets import BDataset
+from ppcd.tools import splicing_list, save_tif, TileWriter, merge_tiles
+from ppcd.utils import auto_cast, trace_span, trace_layers
+from ppcd.utils import hash_arrays, hash_files, hash_model, hash_config, TileStore, LogitsCache
+from ppcd.core.predictor import Predictor
+
+
+# 加载模型参数，静态图预测器不需要加载
+def load_model(model, params_path=None):
+    model.eval()
+    if not isinstance(model, Predictor) and params_path is not None:
+        para_state_dict = paddle.load(params_path)
+        model.set_dict(para_state_dict)
+    # 开启enable_trace时记录每个子层的前向
+    trace_layers(model)
+
+
+# 将网络输出转为保存的图像
+def pred_to_img(pred, threshold=0.5):
+    num_class, H, W = pred.shape[1:]
+    if num_class == 2:
+        return (paddle.argmax(pred, axis=1).squeeze().numpy() * 255).astype('uint8')
+    elif num_class == 1:
+        return ((pred > threshold).numpy().astype('uint8') * 255).reshape([H, W])
+    else:
+        return (paddle.argmax(pred, axis=1).squeeze().numpy()).astype('uint8')
+
+
+# 读取第index块
+def read_tile(infer_data, index):
+    with trace_span('getitem', 'data'):
+        return infer_data[index]
+
+
+# 转为批大小为1的Tensor列表
+def to_tensors(timgs):
+    return [paddle.to_tensor(timg[np.newaxis, :]) for timg in timgs]
+
+
+def tile_tensors(infer_data, index):
+    return to_tensors(read_tile(infer_data, index))
 
 
 def Infer(model, 
           infer_data, 
           params_path=None,
           save_img_path=None,
-          threshold=0.5):
-    # 数据读取器
-    infer_loader = DataLoader(infer_data, batch_size=1)
+          threshold=0.5,
+          amp=None,
+          cache_dir=None):
+    # cache_dir不为None时按 输入文件哈希+模型参数哈希 缓存网络输出（float16），
+    # 再次预测（如只修改threshold）时直接读取缓存，不经过网络；数据增强的配置和amp也属于模型的键，修改后重新计算
     # 开始预测
     if save_img_path is not None:
         if os.path.exists(save_img_path) == False:
             os.mkdir(save_img_path)
-    model.eval()
-    para_state_dict = paddle.load(params_path)
-    model.set_dict(para_state_dict)
+    load_model(model, params_path)
+    cache = None
+    if cache_dir is not None:
+        model_key = hash_config({'model': hash_model(model, params_path), 'amp': amp, \
+                                 'data_format': infer_data.transforms.data_format, \
+                                 'transforms': infer_data.transforms.transforms})
+        cache = LogitsCache(cache_dir, model_key)
     lens = len(infer_data)
-    for idx, infer_load_data in enumerate(infer_loader):
-        if infer_load_data is None:
-            break
-        img, name = infer_load_data
-        pred_list = model(img)
-        # img = paddle.concat([A_img, B_img], axis=1)
-        # pred_list = model(img)
-        num_class, H, W = pred_list[0].shape[1:]
-        if num_class == 2:
-            save_img = (paddle.argmax(pred_list[0], axis=1). \
-                            squeeze().numpy() * 255).astype('uint8')
-        elif num_class == 1:
-            save_img = ((pred_list[0] > threshold).numpy(). \
-                             astype('uint8') * 255).reshape([H, W])
-        else:
-            save_img = (paddle.argmax(pred_list[0], axis=1). \
-                            squeeze().numpy()).astype('uint8')
-        save_path = os.path.join(save_img_path, (name[0] + '.png'))
+    hit_num = 0
+    for idx in range(lens):
+        pred = None
+        if cache is not None:
+            img_path = infer_data.datas[idx]
+            key = hash_files(img_path)
+            logits = cache.get(key)
+            if logits is not None:
+                pred = paddle.to_tensor(logits)
+                name = os.path.splitext(os.path.split(img_path[0])[1])[0]
+                hit_num += 1
+        if pred is None:
+            imgs, name = read_tile(infer_data, idx)
+            with auto_cast(amp):
+                pred_list = model(to_tensors(imgs))
+            # img = paddle.concat([A_img, B_img], axis=1)
+            # pred_list = model(img)
+            pred = pred_list[0]
+            if cache is not None:
+                cache.put(key, pred.astype('float32').numpy())
+        save_img = pred_to_img(pred, threshold)
+        save_path = os.path.join(save_img_path, (name + '.png'))
         print('[Infer] ' + str(idx + 1) + '/' + str(lens) + ' file_path: ' + save_path)
-        cv2.imwrite(save_path, save_img)
+        with trace_span('save_img', 'infer'):
+            cv2.imwrite(save_path, save_img)
+    if cache is not None:
+        print('[Infer] {}/{} predictions loaded from the cache.'.format(hit_num, lens))
+
+
+# 在按scale降采样的整景上预测，返回每个原始块是否需要精细预测
+def coarse_tile_mask(model, infer_data, scale, threshold=0.5, amp=None, margin=1):
+    H, W = infer_data.raw_size
+    ch, cw = infer_data.c_size
+    size = (max(1, round(W / scale)), max(1, round(H / scale)))  # (w, h)
+    coarse_imgs = []
+    with trace_span('coarse_resize', 'infer'):
+        for timg in infer_data.timg[:infer_data.num_image]:
+            cimg = cv2.resize(timg, size, interpolation=cv2.INTER_AREA)
+            coarse_imgs.append(cimg[:, :, np.newaxis] if len(cimg.shape) == 2 else cimg)
+    # 复用BDataset的分块和数据增强
+    coarse_data = BDataset(coarse_imgs, c_size=infer_data.c_size, \
+                           transforms=infer_data.transforms.transforms, \
+                           classes_num=infer_data.classes_num, is_tif=False)
+    coarse_preds = []
+    for index in tqdm(range(len(coarse_data))):
+        with auto_cast(amp):
+            pred_list = model(tile_tensors(coarse_data, index))
+        coarse_preds.append(pred_to_img(pred_list[0], threshold))
+    coarse_mask = splicing_list(coarse_preds, [size[1], size[0]])
+    # 向外扩展margin个粗分辨率像素，避免漏掉边缘的变化
+    if margin > 0:
+        coarse_mask = cv2.dilate(coarse_mask, np.ones((2 * margin + 1, 2 * margin + 1), np.uint8))
+    coarse_mask = coarse_mask > 0
+    row = ceil(H / ch)
+    col = ceil(W / cw)
+    sy = size[1] / H
+    sx = size[0] / W
+    tile_mask = np.zeros([row * col], dtype='bool')
+    for r in range(row):
+        for c in range(col):
+            y0, y1 = floor(r * ch * sy), ceil(min((r + 1) * ch, H) * sy)
+            x0, x1 = floor(c * cw * sx), ceil(min((c + 1) * cw, W) * sx)
+            tile_mask[r * col + c] = coarse_mask[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)].any()
+    return tile_mask
 
 
 # 进行滑框预测
@@ -50,48 +141,170 @@ def Slide_Infer(model,
                 params_path=None,
                 save_img_path=None,
                 threshold=0.5,
-                name='result'):
+                name='result',
+                amp=None,
+                gate=None,
+                gate_threshold=None,
+                coarse_scale=None,
+                coarse_model=None,
+                coarse_margin=1,
+                nodata=None,
+                tile_store=None,
+                date_key=None,
+                resume=False,
+                tile_range=None):
+    # 级联预测：门控(DiffGate/ModelGate)分数小于gate_threshold的块直接视为未变化，阈值可由Calibrate_Gate标定
+    # 由粗到精：coarse_scale不为None时先在降采样coarse_scale倍的整景上用coarse_model(默认为model)预测，
+    # 只对与粗预测变化区（向外扩展coarse_margin个像素）相交的块进行原分辨率预测
+    # BDataset提供nodata/mask/aoi时，无效的块不读取也不预测，结果中的无效像素填充为nodata（默认为0）
+    # 结果为Byte，这里的nodata是输出的NoData值，需要为0-255的整数，与输入影像的nodata（如-9999）无关
+    # 增量预测：tile_store为保存块结果的文件夹，按 模型哈希/date_key(默认为name)/块索引_输入哈希 保存，
+    # 输入没有变化的块直接使用保存的结果
+    # 断点续算：resume为True时每块预测后直接写入GeoTIFF并记录在 name.tif.journal 中，中断后以相同参数
+    # 重新运行会跳过已完成的块；tile_range为[start, end)时只预测这部分块，结果保存为 name_start_end.tif，
+    # 多个任务使用相同的name分担同一景，全部完成后由Merge_Infer合并为 name.tif
+    if tile_range is not None and not resume:
+        raise ValueError('tile_range can only be used when resume is True!')
+    if resume and not infer_data.is_tif:
+        raise ValueError('resume needs the GeoTIFF output, but infer_data is not tif!')
+    if nodata is not None and not (float(nodata).is_integer() and 0 <= nodata <= 255):
+        raise ValueError('The result is Byte, nodata should be an integer in 0-255, but it is {}.'.format(nodata))
+    if gate is not None and gate_threshold is None:
+        raise ValueError('gate_threshold can\'t be None when gate is used, it can be calibrated by Calibrate_Gate!')
     # 信息修改与读取
     infer_data.out_mode = 'slide'  # 滑框模式
     raw_size = infer_data.raw_size  # 原图大小
     is_tif = infer_data.is_tif
     if infer_data.is_tif == True:
         geoinfo = infer_data.geoinfo
-    # 数据读取器
-    # infer_loader = paddle.io.DataLoader(infer_data, batch_size=1)
-    infer_loader = DataLoader(infer_data, batch_size=1)
     # 开始预测
     if save_img_path is not None:
         if os.path.exists(save_img_path) == False:
             os.mkdir(save_img_path)
-    model.eval()
-    para_state_dict = paddle.load(params_path)
-    model.set_dict(para_state_dict)
+    load_model(model, params_path)
+    fill_value = 0 if nodata is None else int(nodata)
+    data_mask = infer_data.tile_mask  # 无数据或感兴趣区外的块为False
+    tile_mask = None
+    if coarse_scale is not None:
+        if coarse_model is not None:
+            load_model(coarse_model)
+        tile_mask = coarse_tile_mask(model if coarse_model is None else coarse_model, infer_data, \
+                                     coarse_scale, threshold, amp, coarse_margin)
+    model_hash = hash_model(model, params_path) if (tile_store is not None or resume) else None
+    store = None
+    if tile_store is not None:
+        model_key = '{}_{}'.format(model_hash, threshold)
+        store = TileStore(tile_store, model_key, name if date_key is None else date_key)
     # lens = len(infer_data)
     inf_imgs = []  # 保存块
-    # for idx, infer_load_data in qenumerate(infer_loader):
-    for infer_load_data in tqdm(infer_loader):
-        if infer_load_data is None:
-            break
-        img = infer_load_data
-        pred_list = model(img)
+    skip_num = 0
+    reuse_num = 0
+    indexs = range(len(infer_data))
+    writer = None
+    if resume:
+        if tile_range is not None:
+            indexs = range(max(0, tile_range[0]), min(len(infer_data), tile_range[1]))
+        if tile_range is not None:
+            save_path = os.path.join(save_img_path, '{}_{}_{}.tif'.format(name, tile_range[0], tile_range[1]))
+        else:
+            save_path = os.path.join(save_img_path, (name + '.tif'))
+        # 模型、参数或输入（影像、有效像素掩膜、需要处理的块）改变时日志的参数头不一致，重新开始
+        header = {'model': model_hash, 'threshold': threshold, 'amp': amp, \
+                  'input': hash_arrays(infer_data.timg[:infer_data.num_image]), \
+                  'valid_mask': hash_arrays([infer_data.valid_mask]) if infer_data.valid_mask is not None else None, \
+                  'tile_mask': hash_arrays([data_mask]) if data_mask is not None else None, \
+                  'transforms': hash_config(infer_data.transforms.transforms), \
+                  'gate': hash_config(gate) if gate is not None else None, 'gate_threshold': gate_threshold, \
+                  'coarse_scale': coarse_scale, 'coarse_margin': coarse_margin, \
+                  'coarse_model': hash_model(coarse_model) if coarse_model is not None else None}
+        writer = TileWriter(save_path, geoinfo, infer_data.c_size, nodata, \
+                            infer_data.valid_mask, fill_value, header=header)
+        if len(writer.done) > 0:
+            print('[Infer] resume from {}, {} tiles done.'.format(save_path, len(writer.done)))
+
+    # 块结果直接写入（断点续算）或保存在列表中最后拼接
+    def emit(index, pred_img):
+        if writer is not None:
+            writer.write(index, pred_img)
+        else:
+            inf_imgs.append(pred_img)
+
+    # 直接按块的索引读取，粗预测或门控未通过的块不经过model
+    for index in tqdm(indexs):
+        if writer is not None and index in writer.done:
+            continue
+        if data_mask is not None and not data_mask[index]:
+            emit(index, np.full(infer_data.c_size, fill_value, dtype='uint8'))
+            skip_num += 1
+            continue
+        if tile_mask is not None and not tile_mask[index]:
+            emit(index, np.zeros(infer_data.c_size, dtype='uint8'))
+            skip_num += 1
+            continue
+        timgs = read_tile(infer_data, index)
+        if store is not None:
+            input_key = hash_arrays(timgs)
+            pred_img = store.get(index, input_key)
+            if pred_img is not None:
+                emit(index, pred_img)
+                reuse_num += 1
+                continue
+        img = to_tensors(timgs)
+        if gate is not None and gate(img)[0] < gate_threshold:
+            emit(index, np.zeros(infer_data.c_size, dtype='uint8'))
+            skip_num += 1
+            continue
+        with auto_cast(amp):
+            pred_list = model(img)
         # img = paddle.concat([A_img, B_img], axis=1)
         # pred_list = model(img)
-        num_class, H, W = pred_list[0].shape[1:]
-        if num_class == 2:
-            inf_imgs.append((paddle.argmax(pred_list[0], axis=1). \
-                            squeeze().numpy() * 255).astype('uint8'))
-        elif num_class == 1:
-            inf_imgs.append(((pred_list[0] > threshold).numpy(). \
-                             astype('uint8') * 255).reshape([H, W]))
+        pred_img = pred_to_img(pred_list[0], threshold)
+        if store is not None:
+            store.put(index, input_key, pred_img)
+        emit(index, pred_img)
+    if gate is not None or tile_mask is not None or data_mask is not None:
+        print('[Infer] {}/{} tiles skipped.'.format(skip_num, len(infer_data)))
+    if store is not None:
+        print('[Infer] {}/{} tiles reused from the tile store.'.format(reuse_num, len(infer_data)))
+    if writer is not None:
+        writer.close()
+        print('[Infer] result saved in: ' + save_path)
+        return
+    with trace_span('splicing_list', 'infer'):
+        fix_img = splicing_list(inf_imgs, raw_size)  # 拼接
+        if infer_data.valid_mask is not None:
+            fix_img[~infer_data.valid_mask] = fill_value
+    with trace_span('save_tif', 'infer'):
+        if is_tif == True:
+            save_path = os.path.join(save_img_path, (name + '.tif'))
+            save_tif(fix_img, geoinfo, save_path, nodata=nodata)
         else:
-            inf_imgs.append((paddle.argmax(pred_list[0], axis=1). \
-                            squeeze().numpy()).astype('uint8'))
-        # print('[Infer] ' + str(idx + 1) + '/' + str(lens))
-    fix_img = splicing_list(inf_imgs, raw_size)  # 拼接
-    if is_tif == True:
-        save_path = os.path.join(save_img_path, (name + '.tif'))
-        save_tif(fix_img, geoinfo, save_path)
-    else:
-        save_path = os.path.join(save_img_path, (name + '.png'))
-        cv2.imwrite(save_path, fix_img)
\ No newline at end of file
+            save_path = os.path.join(save_img_path, (name + '.png'))
+            cv2.imwrite(save_path, fix_img)
+
+
+def Merge_Infer(save_img_path, name='result'):
+    '''
+        合并Slide_Infer按tile_range分给多个任务的结果（name_start_end.tif），按各部分的日志写入 name.tif，
+        各部分的模型、参数及输入需要一致
+        Args:
+            save_img_path (str): 各部分的保存文件夹
+            name (str): 各任务使用的name，默认为'result'
+        Return：
+            save_path (str): 合并结果的路径
+            missing (list): 还没有完成的块，重新运行对应的任务（resume=True）后再合并
+    '''
+    pattern = re.compile(re.escape(name) + r'_(\d+)_(\d+)\.tif$')
+    parts = []
+    for file_name in os.listdir(save_img_path):
+        match = pattern.match(file_name)
+        if match is not None:
+            parts.append((int(match.group(1)), os.path.join(save_img_path, file_name)))
+    if len(parts) == 0:
+        raise ValueError('There is no part of {} in {}!'.format(name, save_img_path))
+    save_path = os.path.join(save_img_path, (name + '.tif'))
+    missing = merge_tiles([part for _, part in sorted(parts)], save_path)
+    if len(missing) > 0:
+        print('[Infer] {} tiles are not finished yet, the first one is {}.'.format(len(missing), missing[0]))
+    print('[Infer] {} parts merged in: {}'.format(len(parts), save_path))
+    return save_path, missing
@@ -0,0 +1,61 @@
+import numpy as np
+import paddle
+from paddle import inference as paddle_infer
+from ppcd.utils import trace_span
+
+
+class Predictor(object):
+    """
+    基于Paddle Inference的静态图预测器，可直接替代动态图模型传入Infer/Slide_Infer
+    Args:
+        model_path (str): Export导出的模型路径前缀（不含.pdmodel/.pdiparams后缀）
+        use_gpu (bool): 是否使用GPU，默认为False
+        cpu_threads (int): CPU计算的线程数，默认为1
+        use_mkldnn (bool): 是否使用oneDNN(MKLDNN)加速，默认为True
+        mkldnn_cache (int): oneDNN对不同输入形状的缓存数，动态形状时避免缓存无限增长，默认为10
+        ir_optim (bool): 是否开启IR图优化，默认为True
+        use_int8 (bool): 是否为Quant得到的INT8模型，需要开启oneDNN，默认为False
+    """
+    def __init__(self, model_path, use_gpu=False, cpu_threads=1, use_mkldnn=True, \
+                 mkldnn_cache=10, ir_optim=True, use_int8=False):
+        self.model_path = model_path
+        config = paddle_infer.Config(model_path + '.pdmodel', model_path + '.pdiparams')
+        if use_gpu:
+            config.enable_use_gpu(100, 0)
+        else:
+            config.disable_gpu()
+            config.set_cpu_math_library_num_threads(cpu_threads)
+            if use_mkldnn:
+                config.enable_mkldnn()
+                config.set_mkldnn_cache_capacity(mkldnn_cache)
+                if use_int8:
+                    config.enable_mkldnn_int8()
+        config.switch_ir_optim(ir_optim)
+        config.enable_memory_optim()
+        config.switch_use_feed_fetch_ops(False)
+        self.predictor = paddle_infer.create_predictor(config)
+        self.input_names = self.predictor.get_input_names()
+        self.output_names = self.predictor.get_output_names()
+
+    def eval(self):
+        # 与nn.Layer的接口保持一致
+        pass
+
+    def __call__(self, images):
+        if len(images) != len(self.input_names):
+            raise ValueError('The length of images should equal to the inputs of model: {} != {}.'
+                             .format(len(images), len(self.input_names)))
+        for name, img in zip(self.input_names, images):
+            if isinstance(img, paddle.Tensor):
+                img = img.numpy()
+            img = np.ascontiguousarray(img, dtype='float32')
+            input_handle = self.predictor.get_input_handle(name)
+            input_handle.reshape(img.shape)
+            input_handle.copy_from_cpu(img)
+        with trace_span('predictor_run', 'forward'):
+            self.predictor.run()
+        results = []
+        for name in self.output_names:
+            output_handle = self.predictor.get_output_handle(name)
+            results.append(paddle.to_tensor(output_handle.copy_to_cpu()))
+        return results
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import paddle
+from ppcd.datasets import DataLoader
+from ppcd.core.eval import Eval
+from ppcd.core.predictor import Predictor
+try:
+    from paddle.static.quantization import PostTrainingQuantization
+except ImportError:
+    from paddle.fluid.contrib.slim.quantization import PostTrainingQuantization
+
+
+# 校准数据生成器，只取出图像列表
+def calib_generator(calib_data, batch_size):
+    def generator():
+        calib_loader = DataLoader(calib_data, batch_size=batch_size)
+        for calib_load_data in calib_loader:
+            if calib_load_data is None:
+                break
+            # 带标签或名称时为(imgs, labs)，否则只有imgs
+            imgs = calib_load_data[0] if isinstance(calib_load_data, tuple) else calib_load_data
+            yield [img.numpy().astype('float32') for img in imgs]
+    return generator
+
+
+def Quant(model_path,
+          calib_data,
+          save_path=None,
+          batch_size=1,
+          batch_nums=10,
+          algo='KL',
+          quantizable_op_type=['conv2d', 'depthwise_conv2d', 'mul', 'matmul'],
+          eval_data=None,
+          threshold=0.5,
+          cpu_threads=1):
+    '''
+        基于校准数据的训练后量化（PTQ），将Export导出的FP32模型量化为INT8模型
+        Args:
+            model_path (str): Export导出的模型路径前缀
+            calib_data (CDataset/BDataset): 校准数据，只需要一小部分训练数据
+            save_path (str): INT8模型保存的文件夹
+            batch_size (int): 校准的批大小，默认为1
+            batch_nums (int): 校准的批数，默认为10
+            algo (str): 量化参数的计算方法，可选参数为 ['KL', 'hist', 'avg', 'mse', 'abs_max']，默认为'KL'
+            quantizable_op_type (list): 需要量化的算子类型
+            eval_data (CDataset/BDataset/None): 评估精度变化的数据，为None时不进行评估，默认为None
+            threshold (float): 单通道输出时的阈值，默认为0.5
+            cpu_threads (int): 评估时CPU计算的线程数，默认为1
+        Return：
+            int8_model_path (str): INT8模型的路径前缀，可以直接用于Predictor(use_int8=True)
+    '''
+    if save_path is None:
+        raise ValueError('save_path can\'t be None!')
+    if os.path.exists(save_path) == False:
+        os.makedirs(save_path)
+    model_dir, model_name = os.path.split(model_path)
+    paddle.enable_static()
+    try:
+        exe = paddle.static.Executor(paddle.CPUPlace())
+        ptq = PostTrainingQuantization(
+            executor=exe,
+            model_dir=model_dir,
+            model_filename=(model_name + '.pdmodel'),
+            params_filename=(model_name + '.pdiparams'),
+            batch_generator=calib_generator(calib_data, batch_size),
+            batch_size=batch_size,
+            batch_nums=batch_nums,
+            algo=algo,
+            quantizable_op_type=quantizable_op_type)
+        ptq.quantize()
+        ptq.save_quantized_model(
+            save_path,
+            model_filename='model.pdmodel',
+            params_filename='model.pdiparams')
+    finally:
+        paddle.disable_static()
+    int8_model_path = os.path.join(save_path, 'model')
+    print('[Quant] INT8 model saved in: ' + save_path)
+    # 通过ComputAccuracy比较量化前后的精度
+    if eval_data is not None:
+        names = ['miou', 'acc', 'f1', 'kappa']
+        fp32_res = Eval(Predictor(model_path, cpu_threads=cpu_threads), eval_data, \
+                        threshold=threshold, show_result=False)
+        int8_res = Eval(Predictor(int8_model_path, cpu_threads=cpu_threads, use_int8=True), \
+                        eval_data, threshold=threshold, show_result=False)
+        fp32_res = [fp32_res[1], fp32_res[3], fp32_res[5], fp32_res[7]]
+        int8_res = [int8_res[1], int8_res[3], int8_res[5], int8_res[7]]
+        for name, fp32_v, int8_v in zip(names, fp32_res, int8_res):
+            print("[Quant] {}: fp32 {:.4f}, int8 {:.4f}, delta {:.4f}".format(
+                name, np.mean(fp32_v), np.mean(int8_v), np.mean(int8_v) - np.mean(fp32_v)))
+    return int8_model_path
@@ -1,14 +1,61 @@
 import os
+import contextlib
 import numpy as np
 import paddle
+import paddle.distributed as dist
 # from paddle.io import DataLoader
 from ppcd.datasets import DataLoader
+from ppcd.transforms import Normalize
 from ppcd.utils import loss_computation
-from ppcd.utils import TimeAverager, calculate_eta
+from ppcd.utils import TimeAverager, StageTimer, calculate_eta
+from ppcd.utils import auto_cast, grad_scaler
+from ppcd.utils import CheckpointSaver
+from ppcd.utils import LossAverager, AsyncLogWriter
+from ppcd.utils import trace_span, trace_layers
 from visualdl import LogWriter
 import time
 # from tqdm import tqdm
-from ppcd.core.eval import Eval
+from ppcd.core.eval import Eval, log_eval
+from ppcd.core.async_eval import AsyncEval
+
+
+# 非0号进程不写日志
+class NullWriter(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+
+# CPU上没有SyncBatchNorm的算子，在评估和保存前对各个进程BN的统计量求平均
+def average_bn_stats(model, nranks):
+    for sublayer in model.sublayers():
+        if isinstance(sublayer, (paddle.nn.BatchNorm, paddle.nn.BatchNorm1D, \
+                                 paddle.nn.BatchNorm2D, paddle.nn.BatchNorm3D)):
+            for stat in [sublayer._mean, sublayer._variance]:
+                dist.all_reduce(stat)
+                stat.set_value(stat / nranks)
+
+
+# 按时间保存由0号进程决定，需要对BN统计量求平均时广播给所有进程，保证各进程同时进行all_reduce
+def time_to_save(saver, sync):
+    flag = saver is not None and saver.time_to_save()
+    if sync:
+        flag_t = paddle.to_tensor([int(flag)], dtype='int32')
+        dist.broadcast(flag_t, src=0)
+        flag = bool(flag_t.numpy()[0])
+    return flag
+
+
+# 检查点写入完成后提交给后台评估
+def submit_eval(evaluator, epoch_id, step):
+    if evaluator is None:
+        return None
+    return lambda params_path: evaluator.submit(params_path, epoch_id, step)
 
 
 def Train(model, 
@@ -22,74 +69,182 @@ def Train(model,
           save_model_path=None,
           save_epoch=2,
           log_batch=10,
-          threshold=0.5):
+          threshold=0.5,
+          amp=None,
+          accumulate_steps=1,
+          distributed=False,
+          sync_bn=False,
+          async_eval=False,
+          eval_model_fn=None,
+          eval_device=None,
+          keep_last=None,
+          save_minutes=None,
+          profile=False,
+          batch_transforms=None):
     # dataloader = CDataLoader if loader == 'CDataLoader' else DataLoader
     dataloader = DataLoader
-    data_lens = len(train_data) // batch_size  # 训练数据数
+    # 梯度累积，batch_size为等效的批大小，每次读取并计算micro_batch_size的数据
+    if accumulate_steps < 1 or batch_size % accumulate_steps != 0:
+        raise ValueError('batch_size should be divisible by accumulate_steps: {} % {} != 0.'
+                         .format(batch_size, accumulate_steps))
+    micro_batch_size = batch_size // accumulate_steps
+    # BatchNormalize只作用于训练的批，评估数据需要自己的Normalize，否则训练与评估的输入不一致
+    if batch_transforms is not None and getattr(batch_transforms, 'normalized', False) and \
+       eval_data is not None and \
+       not any(isinstance(op, Normalize) for op in (eval_data.transforms.transforms or [])):
+        raise ValueError('batch_transforms includes BatchNormalize, but eval_data has no Normalize, ' \
+                         'add Normalize with the same mean/std to the transforms of eval_data!')
+    # 数据并行，每个进程读取不同的批，只有0号进程保存模型和日志
+    rank = dist.get_rank() if distributed else 0
+    nranks = dist.get_world_size() if distributed else 1
+    data_lens = len(train_data) // micro_batch_size // nranks  # 训练数据数
     # 创建模型保存文件夹
-    if save_model_path is not None:
+    if save_model_path is not None and rank == 0:
         if os.path.exists(save_model_path) == False:
             os.mkdir(save_model_path)
     # 加载预训练参数
     if pre_params_path is not None:
         para_state_dict = paddle.load(pre_params_path)
         model.set_dict(para_state_dict)
-    # 计时
+    sync_bn_stats = False
+    if nranks > 1:
+        if sync_bn and paddle.get_device() != 'cpu':
+            model = paddle.nn.SyncBatchNorm.convert_sync_batchnorm(model)
+        elif sync_bn:
+            sync_bn_stats = True
+        train_model = paddle.DataParallel(model)
+    else:
+        train_model = model
+    # 开启enable_trace时记录每个子层的前向
+    trace_layers(model)
+    # 混合精度，fp16需要损失缩放
+    scaler = grad_scaler(amp)
+    # 计时，profile时记录每一步各个阶段的耗时，只有0号进程输出日志并清空记录，其余进程不记录
     batch_cost_averager = TimeAverager()
+    loss_averager = LossAverager()  # 损失在设备上累加，只在输出日志时同步
+    sync_fn = paddle.device.cuda.synchronize if 'gpu' in paddle.get_device() else None
+    stage_timer = StageTimer(enable=(profile and rank == 0), sync_fn=sync_fn)
     # 开始训练
-    with LogWriter(logdir=("./log/" + str(time.mktime(time.localtime())))) as writer:
+    logdir = "./log/" + str(time.mktime(time.localtime()))
+    log_writer = LogWriter(logdir=logdir) if rank == 0 else NullWriter()
+    # 后台评估，训练不等待评估结束
+    evaluator = None
+    if async_eval and eval_data is not None and rank == 0:
+        if save_model_path is None:
+            raise ValueError('save_model_path can\'t be None when async_eval is True!')
+        # 后台进程为spawn，需要由eval_model_fn重新构建网络
+        if eval_model_fn is None:
+            raise ValueError('eval_model_fn can\'t be None when async_eval is True!')
+        evaluator = AsyncEval(eval_model_fn, eval_data, logdir, losses=losses, threshold=threshold, \
+                              amp=amp, device=eval_device)
+    # 后台保存模型，按epoch和时间保存，保留最近keep_last个及miou最好的检查点
+    saver = None
+    if save_model_path is not None and rank == 0:
+        saver = CheckpointSaver(save_model_path, keep_last=keep_last, save_minutes=save_minutes)
+    with AsyncLogWriter(log_writer) as writer:
         iters = 0
         for epoch_id in range(epoch): 
             model.train()
-            train_loader = dataloader(train_data, batch_size=batch_size, shuffle=True)  # 数据读取器
+            # 数据并行时各进程使用相同的种子打乱后再分片，单进程时不固定种子
+            train_loader = dataloader(train_data, batch_size=micro_batch_size, shuffle=True, \
+                                      rank=rank, nranks=nranks, \
+                                      seed=epoch_id if distributed else None)  # 数据读取器
+            batch_start = time.time()  # batch计时，包括数据读取
             for batch_id, train_load_data in enumerate(train_loader):
-                batch_start = time.time()  # batch计时
                 if train_load_data is None:
                     break
+                reader_cost = time.time() - batch_start
+                stage_timer.record('reader', reader_cost - train_loader.h2d_time)
+                stage_timer.record('h2d', train_loader.h2d_time)
+                stage_timer.start()
                 img, lab = train_load_data
+                # 在整批数据上进行数据增强（BatchCompose）
+                if batch_transforms is not None:
+                    with trace_span('batch_transforms', 'train'):
+                        img, lab = batch_transforms(img, lab)
+                    stage_timer.tick('augment')
                 iters += 1
-                pred_list = model(img)
-                # img = paddle.concat([A_img, B_img], axis=1)
-                # pred_list = model(img)
-                loss_list = loss_computation(
-                    logits_list=pred_list,
-                    labels=lab,
-                    losses=losses,
-                    epoch=epoch_id,
-                    batch=batch_id)
-                loss = sum(loss_list)
-                loss.backward()
-                optimizer.step()
-                optimizer.clear_grad()
-                batch_cost_averager.record((time.time() - batch_start), num_samples=batch_size)
-                if (batch_id + 1) % log_batch == 0:
+                # 当前累积组的大小，最后一组可能不足accumulate_steps
+                step_id = batch_id // accumulate_steps
+                group_size = min(accumulate_steps, data_lens - step_id * accumulate_steps)
+                # 累积时只在更新参数的micro batch同步梯度
+                is_update = (batch_id + 1) % accumulate_steps == 0 or batch_id == (data_lens - 1)
+                grad_sync = train_model.no_sync() if (nranks > 1 and not is_update) \
+                            else contextlib.nullcontext()
+                with grad_sync, auto_cast(amp):
+                    pred_list = train_model(img)
+                    stage_timer.tick('forward')
+                    # img = paddle.concat([A_img, B_img], axis=1)
+                    # pred_list = model(img)
+                    # 衰减按优化步计算，保证同一步中的各个micro batch一致
+                    with trace_span('loss_computation', 'train'):
+                        loss_list = loss_computation(
+                            logits_list=pred_list,
+                            labels=lab,
+                            losses=losses,
+                            epoch=epoch_id,
+                            batch=step_id)
+                        loss = sum(loss_list)
+                    loss_averager.record(loss)
+                    acc_loss = loss / group_size if group_size > 1 else loss
+                    stage_timer.tick('loss')
+                    with trace_span('backward', 'train'):
+                        if scaler is not None:
+                            scaled_loss = scaler.scale(acc_loss)
+                            scaled_loss.backward()
+                        else:
+                            acc_loss.backward()
+                    stage_timer.tick('backward')
+                # 累积满一组后更新参数
+                if is_update:
+                    with trace_span('optimizer', 'train'):
+                        if scaler is not None:
+                            scaler.minimize(optimizer, scaled_loss)
+                        else:
+                            optimizer.step()
+                        optimizer.clear_grad()
+                    stage_timer.tick('optimizer')
+                batch_cost_averager.record((time.time() - batch_start), num_samples=micro_batch_size)
+                if (batch_id + 1) % log_batch == 0 and rank == 0:
                     avg_train_batch_cost = batch_cost_averager.get_average()
                     eta = calculate_eta((epoch * data_lens - iters), avg_train_batch_cost)
+                    avg_loss = loss_averager.get_average()
                     print("[Train] epoch: {}, batch: {}, loss: {:.4f}, ips: {:.4f}, ETA: {}".format(
-                        epoch_id + 1, batch_id + 1, loss.numpy()[0], \
+                        epoch_id + 1, batch_id + 1, avg_loss, \
                         batch_cost_averager.get_ips_average(), eta))
-                    writer.add_scalar(tag="train/loss", step=iters, value=loss.numpy()[0])
+                    writer.add_scalar(tag="train/loss", step=iters, value=avg_loss)
                     batch_cost_averager.reset()
-                if ((epoch_id + 1) % save_epoch) == 0 and (batch_id == (data_lens - 1)) and \
-                   eval_data is not None:
-                    val_losses, val_mious, val_class_miou, val_maccs, val_class_acc, val_mf1s, val_class_f1, val_kappas = Eval(
-                        model=model,
-                        eval_data=eval_data,
-                        losses=losses,
-                        threshold=threshold,
-                        show_result=False
-                    )
-                    print("[Eval] epoch: {}, loss: {:.4f}, miou: {:.4f}, class_miou: {}, acc: {:.4f}, class_acc: {}, f1: {:.4f}, class_f1: {}, kappa: {:.4f}" \
-                          .format(epoch_id + 1, np.mean(val_losses), np.mean(val_mious), \
-                          str(np.round(val_class_miou, 4)), np.mean(val_maccs), \
-                          str(np.round(val_class_acc, 4)), np.mean(val_mf1s), \
-                          str(np.round(val_class_f1, 4)), np.mean(val_kappas)))
-                    writer.add_scalar(tag="eval/loss", step=iters, value=np.mean(val_losses))
-                    writer.add_scalar(tag="eval/acc", step=iters, value=np.mean(val_maccs))
-                    writer.add_scalar(tag="eval/miou", step=iters, value=np.mean(val_mious))
-                    writer.add_scalar(tag="eval/f1", step=iters, value=np.mean(val_mf1s))
-                    writer.add_scalar(tag="eval/kappa", step=iters, value=np.mean(val_kappas))
-                    paddle.save(model.state_dict(), os.path.join(save_model_path, 'epoch_' + \
-                                str(epoch_id)) + '.pdparams')
-                    paddle.save(optimizer.state_dict(), os.path.join(save_model_path, 'epoch_' + \
-                                str(epoch_id)) + '.pdopt')
\ No newline at end of file
+                    loss_averager.reset()
+                    stage_timer.tick('log')
+                    stage_timer.log(writer, iters)
+                    stage_timer.reset()
+                epoch_save = ((epoch_id + 1) % save_epoch) == 0 and (batch_id == (data_lens - 1))
+                time_save = not epoch_save and is_update and save_minutes is not None and \
+                            time_to_save(saver, sync_bn_stats)
+                if sync_bn_stats and (epoch_save or time_save):
+                    average_bn_stats(model, nranks)
+                if epoch_save and rank == 0:
+                    metric = None
+                    if eval_data is not None and evaluator is None:
+                        eval_result = Eval(
+                            model=model,
+                            eval_data=eval_data,
+                            losses=losses,
+                            threshold=threshold,
+                            show_result=False,
+                            amp=amp
+                        )
+                        log_eval(writer, eval_result, epoch_id, iters)
+                        metric = np.mean(eval_result[1])  # miou
+                    if saver is not None:
+                        saver.save('epoch_' + str(epoch_id), model.state_dict(), optimizer.state_dict(), \
+                                   metric=metric, callback=submit_eval(evaluator, epoch_id, iters))
+                elif saver is not None and time_save:
+                    saver.save('iter_' + str(iters), model.state_dict(), optimizer.state_dict(), \
+                               callback=submit_eval(evaluator, epoch_id, iters))
+                batch_start = time.time()
+    # 等待保存和评估完成
+    if saver is not None:
+        saver.close()
+    if evaluator is not None:
+        evaluator.close()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import time
 import random
 import numpy as np
 import paddle
@@ -6,7 +7,8 @@ from math import ceil
 from PIL import Image
 from paddle.io import Dataset
 from ppcd.transforms import Compose
-from ppcd.tools import random_out, slide_out, open_tif
+from ppcd.tools import random_out, slide_out, open_tif, tiles_any, rasterize_polygons, read_polygons
+from ppcd.utils.tracer import trace_span
 
 
 # TODO: 多输入切分
@@ -79,13 +81,17 @@ def split_create_list_class(dataset_path, split_rate=[8, 1, 1], shuffle=True):
 
 class CDataset(Dataset):
     def __init__(self, data_list_path, data_format='HWC', separator=' ', \
-                 transforms=None, classes_num=2, is_infer=False, shuffle=False):
+                 transforms=None, classes_num=2, is_infer=False, shuffle=False, \
+                 profile=False, profile_memory=False, fuse_geometric=False, fuse_interp='NEAREST'):
         '''
         说明：
             data_format针对的是npy和npz的数据，因为TIF读取默认为CHW会自动转为HWC，JPG/PNG的读取默认就是HWC
+            profile/profile_memory传给Compose，统计每个算子的耗时，通过self.transforms.summary()查看
+            fuse_geometric/fuse_interp传给Compose，将连续的几何变换合并为一次warpAffine
         '''
-        self.transforms = Compose(transforms=transforms, \
-                                  data_format=data_format, classes_num=classes_num)
+        self.transforms = Compose(transforms=transforms, data_format=data_format, classes_num=classes_num, \
+                                  profile=profile, profile_memory=profile_memory, \
+                                  fuse_geometric=fuse_geometric, fuse_interp=fuse_interp)
         self.datas = []
         self.is_infer = is_infer
         self.classes_num = classes_num
@@ -103,11 +109,16 @@ class CDataset(Dataset):
                 self.datas.append([fdata[:-1], fdata[-1].split('?')])
                 self.num_image = len(fdata[:-1])
         self.lens = len(self.datas)
+        self.raw_datas = list(self.datas)  # 文件中的顺序，带seed打乱时从此顺序开始，各进程结果一致
         if shuffle == True:
             random.shuffle(self.datas)
 
-    def refresh_data(self):
-        random.shuffle(self.datas)
+    def refresh_data(self, seed=None):
+        if seed is None:
+            random.shuffle(self.datas)
+        else:
+            self.datas = list(self.raw_datas)
+            random.Random(seed).shuffle(self.datas)
 
     def __getitem__(self, index):
         labs = []
@@ -154,13 +165,23 @@ class CDataset(Dataset):
 # 大范围的遥感数据（目前只支持一个label）
 class BDataset(Dataset):
     def __init__(self, img_source, lab_source=None, c_size=[512, 512], \
-                 transforms=None, classes_num=2, out_mode='random', is_tif=True, geoinfo=None):
+                 transforms=None, classes_num=2, out_mode='random', is_tif=True, geoinfo=None, \
+                 nodata=None, mask=None, aoi=None, profile=False, profile_memory=False, \
+                 fuse_geometric=False, fuse_interp='NEAREST'):
         '''
             t_list以及lab (str/ndarray)
+            nodata (int/float/None): 无数据值，任一时段所有波段均为nodata的像素无效
+            mask (str/ndarray/None): 掩膜波段（路径或[H, W]），非0为有效
+            aoi (str/list/None): 感兴趣区，矢量文件路径或多边形坐标列表[[(x, y), ...], ...]，有geoinfo时为地理坐标
+            滑框预测时跳过没有有效像素或不在感兴趣区内的块（tile_mask）
+            profile/profile_memory传给Compose，统计每个算子的耗时，通过self.transforms.summary()查看
+            fuse_geometric/fuse_interp传给Compose，将连续的几何变换合并为一次warpAffine
         '''
         self.classes_num = classes_num
         self.num_image = len(img_source)
-        self.transforms = Compose(transforms=transforms, classes_num=classes_num)
+        self.transforms = Compose(transforms=transforms, classes_num=classes_num, \
+                                  profile=profile, profile_memory=profile_memory, \
+                                  fuse_geometric=fuse_geometric, fuse_interp=fuse_interp)
         self.timg = []
         if isinstance(img_source[0], str):
             if is_tif == False:
@@ -188,8 +209,32 @@ class BDataset(Dataset):
         self.lens = ceil(self.timg[0].shape[0] / c_size[0]) * ceil(self.timg[0].shape[1] / c_size[1])
         if self.lab is not None:
             self.timg.append(self.lab)
+        self.valid_mask, self.tile_mask = self.create_masks(nodata, mask, aoi)
+
+    def create_masks(self, nodata, mask, aoi):
+        '''
+            有效像素的掩膜[H, W]及每块是否需要处理，都不提供时为None
+        '''
+        valid_mask = None
+        if nodata is not None:
+            valid_mask = np.ones(self.raw_size, dtype='bool')
+            for timg in self.timg[:self.num_image]:
+                valid = timg != nodata
+                valid_mask &= valid.any(axis=2) if len(valid.shape) == 3 else valid
+        if mask is not None:
+            if isinstance(mask, str):
+                mask = open_tif(mask).ReadAsArray() if self.is_tif else np.asarray(Image.open(mask))
+                mask = mask[0] if len(mask.shape) == 3 else mask
+            mask = np.asarray(mask) != 0
+            valid_mask = mask if valid_mask is None else (valid_mask & mask)
+        tile_mask = tiles_any(valid_mask, self.c_size) if valid_mask is not None else None
+        if aoi is not None:
+            polygons = read_polygons(aoi) if isinstance(aoi, str) else aoi
+            aoi_mask = rasterize_polygons(polygons, self.raw_size, self.c_size, self.geoinfo)
+            tile_mask = aoi_mask if tile_mask is None else (tile_mask & aoi_mask)
+        return valid_mask, tile_mask
 
-    def refresh_data(self):
+    def refresh_data(self, seed=None):
         pass
 
     def __getitem__(self, index):
@@ -249,17 +294,26 @@ class Dataset(object):
 
 # 数据读取器
 class DataLoader(object):
-    def __init__(self, cdataset, batch_size, shuffle=False, is_val=False):
+    def __init__(self, cdataset, batch_size, shuffle=False, is_val=False, rank=0, nranks=1, seed=None):
+        '''
+            rank/nranks用于数据并行时按批切分数据，seed保证各个进程打乱的顺序一致（不受各进程构建CDataset时shuffle的影响）
+        '''
         self.cdataset = cdataset
         if shuffle:
-            self.cdataset.refresh_data()
+            # 有seed时从数据集原本的顺序打乱，与构建数据集时是否打乱无关
+            self.cdataset.refresh_data(seed)
         self.batch_size = batch_size
         self.is_val = is_val
         if self.is_val:
-            self.index = iter(range(ceil(len(self.cdataset) / self.batch_size)))
+            batch_num = ceil(len(self.cdataset) / self.batch_size)
         else:
-            self.index = iter(range(len(self.cdataset) // self.batch_size))
+            batch_num = len(self.cdataset) // self.batch_size
+        # 每个进程的批数需要相同，多余的批丢弃
+        if nranks > 1:
+            batch_num = (batch_num // nranks) * nranks
+        self.index = iter(range(rank, batch_num, nranks))
         self.num_image = cdataset.num_image
+        self.h2d_time = 0  # 最近一批数据转为Tensor的耗时
 
     def __iter__(self):
         return self
@@ -274,7 +328,8 @@ class DataLoader(object):
             if end > len(self.cdataset):
                 end = len(self.cdataset)
             for i in range(start, end, 1):
-                idata = self.cdataset[i]
+                with trace_span('getitem', 'data'):
+                    idata = self.cdataset[i]
                 if isinstance(idata[0], list):
                     timgs, que = idata
                 else:
@@ -287,21 +342,26 @@ class DataLoader(object):
                         ts[j] = [timgs[j]]
                 if que is not None:
                     ques.append(que)
-            tsed = []
-            for i in range(len(ts)):
-                tsed.append(paddle.to_tensor(np.array(ts[i])))
-            ts = tsed
-            # 标签
-            if ques != []:
-                if isinstance(ques[0], list):
-                    ques = np.array(ques).transpose((1, 0, 2, 3, 4))
-                    quesed = []
-                    for i in range(ques.shape[0]):
-                        quesed.append(paddle.to_tensor(np.array(ques[i, :, : ,:, :])))
-                    ques = quesed
-                else:
-                    if not isinstance(ques[0], str):  # 如果是一个分类标签
-                        ques = paddle.to_tensor(ques)
+            has_lab = ques != []
+            with trace_span('collate', 'data'):
+                tsed = []
+                h2d_start = time.time()
+                for i in range(len(ts)):
+                    tsed.append(paddle.to_tensor(np.array(ts[i])))
+                ts = tsed
+                # 标签
+                if has_lab:
+                    if isinstance(ques[0], list):
+                        ques = np.array(ques).transpose((1, 0, 2, 3, 4))
+                        quesed = []
+                        for i in range(ques.shape[0]):
+                            quesed.append(paddle.to_tensor(np.array(ques[i, :, : ,:, :])))
+                        ques = quesed
+                    else:
+                        if not isinstance(ques[0], str):  # 如果是一个分类标签
+                            ques = paddle.to_tensor(ques)
+                self.h2d_time = time.time() - h2d_start
+            if has_lab:
                 return ts, ques
             else:
                 return ts
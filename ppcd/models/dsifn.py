@@ -3,6 +3,7 @@ import paddle.nn as nn
 import paddle.nn.functional as F
 from paddle.vision.models import vgg16
 from ppcd.models.layers import CAM, SAM
+from ppcd.models.layers import check_recompute, recompute_stage
 
 
 class Vgg16Base(nn.Layer):
@@ -45,9 +46,12 @@ class DSIFN(nn.Layer):
     Args:
         in_channels (int, optional): The channel number of input image.  default:3.
         num_classes (int, optional): The unique number of target classes.  default:2.
+        recompute (bool|list, optional): Recompute the activations of decoder branches (1-5) in backward
+            to save memory, True means all branches.  default:None.
     """
-    def __init__(self, in_channels=3, num_classes=2):
+    def __init__(self, in_channels=3, num_classes=2, recompute=None):
         super().__init__()
+        self.recompute_stages = check_recompute(recompute, 5)
         self.backbone = Vgg16Base(in_channels=in_channels)
         self.sa1 = SAM()
         self.sa2 = SAM()
@@ -95,10 +99,8 @@ class DSIFN(nn.Layer):
         self.bn_sa5 = nn.BatchNorm(16)
         self.o5_conv4 = nn.Conv2D(16, num_classes, 1)
 
-    def forward(self, images):
-        t1_f_l3, t1_f_l8, t1_f_l15, t1_f_l22, t1_f_l29 = self.backbone(images[0])
-        t2_f_l3, t2_f_l8, t2_f_l15, t2_f_l22, t2_f_l29 = self.backbone(images[1])
-        x = paddle.concat([t1_f_l29, t2_f_l29], axis=1)
+    def branch1(self, t1_f, t2_f):
+        x = paddle.concat([t1_f, t2_f], axis=1)
         x = self.ca1(x) * x
         x = self.o1_conv1(x)
         x = self.o1_conv2(x)
@@ -106,7 +108,10 @@ class DSIFN(nn.Layer):
         x = self.bn_sa1(x)
         branch_1_out = self.o1_conv3(x)
         x = self.trans_conv1(x)
-        x = paddle.concat([x, t1_f_l22, t2_f_l22], axis=1)
+        return branch_1_out, x
+
+    def branch2(self, x, t1_f, t2_f):
+        x = paddle.concat([x, t1_f, t2_f], axis=1)
         x = self.ca2(x) * x
         x = self.o2_conv1(x)
         x = self.o2_conv2(x)
@@ -115,7 +120,10 @@ class DSIFN(nn.Layer):
         x = self.bn_sa2(x)
         branch_2_out = self.o2_conv4(x)
         x = self.trans_conv2(x)
-        x = paddle.concat([x, t1_f_l15, t2_f_l15], axis=1)
+        return branch_2_out, x
+
+    def branch3(self, x, t1_f, t2_f):
+        x = paddle.concat([x, t1_f, t2_f], axis=1)
         x = self.ca3(x) * x
         x = self.o3_conv1(x)
         x = self.o3_conv2(x)
@@ -124,7 +132,10 @@ class DSIFN(nn.Layer):
         x = self.bn_sa3(x)
         branch_3_out = self.o3_conv4(x)
         x = self.trans_conv3(x)
-        x = paddle.concat([x, t1_f_l8, t2_f_l8], axis=1)
+        return branch_3_out, x
+
+    def branch4(self, x, t1_f, t2_f):
+        x = paddle.concat([x, t1_f, t2_f], axis=1)
         x = self.ca4(x) * x
         x = self.o4_conv1(x)
         x = self.o4_conv2(x)
@@ -133,7 +144,10 @@ class DSIFN(nn.Layer):
         x = self.bn_sa4(x)
         branch_4_out =self.o4_conv4(x)
         x = self.trans_conv4(x)
-        x = paddle.concat([x, t1_f_l3, t2_f_l3], axis=1)
+        return branch_4_out, x
+
+    def branch5(self, x, t1_f, t2_f):
+        x = paddle.concat([x, t1_f, t2_f], axis=1)
         x = self.ca5(x) * x
         x = self.o5_conv1(x)
         x = self.o5_conv2(x)
@@ -141,4 +155,14 @@ class DSIFN(nn.Layer):
         x = self.sa5(x) * x
         x = self.bn_sa5(x)
         branch_5_out = self.o5_conv4(x)
+        return branch_5_out
+
+    def forward(self, images):
+        t1_f_l3, t1_f_l8, t1_f_l15, t1_f_l22, t1_f_l29 = self.backbone(images[0])
+        t2_f_l3, t2_f_l8, t2_f_l15, t2_f_l22, t2_f_l29 = self.backbone(images[1])
+        branch_1_out, x = recompute_stage(self, 1, self.branch1, t1_f_l29, t2_f_l29)
+        branch_2_out, x = recompute_stage(self, 2, self.branch2, x, t1_f_l22, t2_f_l22)
+        branch_3_out, x = recompute_stage(self, 3, self.branch3, x, t1_f_l15, t2_f_l15)
+        branch_4_out, x = recompute_stage(self, 4, self.branch4, x, t1_f_l8, t2_f_l8)
+        branch_5_out = recompute_stage(self, 5, self.branch5, x, t1_f_l3, t2_f_l3)
         return [branch_5_out, branch_4_out, branch_3_out, branch_2_out, branch_1_out]
\ No newline at end of file
@@ -4,6 +4,7 @@ import paddle.nn.functional as F
 # from paddle.vision.models import ResNet
 import math
 from ppcd.models.layers import constant_init, normal_init
+from ppcd.models.layers import check_recompute, recompute_stage
 
 
 class SELayer(nn.Layer):
@@ -127,8 +128,10 @@ class SCSEBlock(nn.Layer):
 
 
 class CDNet(nn.Layer):
-    def __init__(self, in_channels, block, layers, num_classes=2):
+    # recompute: 1/2为两个时段的解码器，3为变化的主解码器，True为全部
+    def __init__(self, in_channels, block, layers, num_classes=2, recompute=None):
         super(CDNet, self).__init__()
+        self.recompute_stages = check_recompute(recompute, 3)
         filters = [64, 128, 256, 512]
         self.in_planes = 64
         self.firstconv = nn.Conv2D(in_channels, 64, kernel_size=7, stride=2, padding=3)
@@ -181,49 +184,33 @@ class CDNet(nn.Layer):
             layers.append(block(self.in_planes, planes))
         return nn.Sequential(*layers)
 
-    def forward(self, images):
-        # Encoder_1
-        x = self.firstconv(images[0])
+    def encode(self, x):
+        x = self.firstconv(x)
         x = self.firstbn(x)
         x = F.relu(x)
         x = self.firstmaxpool(x)
-        e1_x = self.encoder1(x)
-        e2_x = self.encoder2(e1_x)
-        e3_x = self.encoder3(e2_x)
-        e4_x = self.encoder4(e3_x)
-        # Center_1
-        e4_x_center = self.dblock(e4_x)
-        # Decoder_1
-        d4_x = self.decoder4(e4_x_center) + e3_x
-        d3_x = self.decoder3(d4_x) + e2_x
-        d2_x = self.decoder2(d3_x) + e1_x
-        d1_x = self.decoder1(d2_x)
-        out1 = self.finaldeconv1(d1_x)
-        out1 = F.relu(out1)
-        out1 = self.finalconv2(out1)
-        out1 = F.relu(out1)
-        out1 = self.finalconv3(out1)
-        # Encoder_2
-        y = self.firstconv(images[1])
-        y = self.firstbn(y)
-        y = F.relu(y)
-        y = self.firstmaxpool(y)
-        e1_y = self.encoder1(y)
-        e2_y = self.encoder2(e1_y)
-        e3_y = self.encoder3(e2_y)
-        e4_y = self.encoder4(e3_y)
-        # Center_2
-        e4_y_center = self.dblock(e4_y)
-        # Decoder_2
-        d4_y = self.decoder4(e4_y_center) + e3_y
-        d3_y = self.decoder3(d4_y) + e2_y
-        d2_y = self.decoder2(d3_y) + e1_y
-        d1_y = self.decoder1(d2_y)
-        out2 = self.finaldeconv1(d1_y)
-        out2 = F.relu(out2)
-        out2 = self.finalconv2(out2)
-        out2 = F.relu(out2)
-        out2 = self.finalconv3(out2)
+        e1 = self.encoder1(x)
+        e2 = self.encoder2(e1)
+        e3 = self.encoder3(e2)
+        e4 = self.encoder4(e3)
+        return e1, e2, e3, e4
+
+    def decode(self, e1, e2, e3, e4):
+        # Center
+        e4_center = self.dblock(e4)
+        # Decoder
+        d4 = self.decoder4(e4_center) + e3
+        d3 = self.decoder3(d4) + e2
+        d2 = self.decoder2(d3) + e1
+        d1 = self.decoder1(d2)
+        out = self.finaldeconv1(d1)
+        out = F.relu(out)
+        out = self.finalconv2(out)
+        out = F.relu(out)
+        out = self.finalconv3(out)
+        return out
+
+    def decode_master(self, e1_x, e2_x, e3_x, e4_x, e1_y, e2_y, e3_y, e4_y):
         # center_master
         e4 = self.dblock_master(e4_x - e4_y)
         # decoder_master
@@ -236,6 +223,20 @@ class CDNet(nn.Layer):
         out = self.finalconv2_master(out)
         out = F.relu(out)
         out = self.finalconv3_master(out)
+        return out
+
+    def forward(self, images):
+        # Encoder_1
+        e1_x, e2_x, e3_x, e4_x = self.encode(images[0])
+        # Decoder_1
+        out1 = recompute_stage(self, 1, self.decode, e1_x, e2_x, e3_x, e4_x)
+        # Encoder_2
+        e1_y, e2_y, e3_y, e4_y = self.encode(images[1])
+        # Decoder_2
+        out2 = recompute_stage(self, 2, self.decode, e1_y, e2_y, e3_y, e4_y)
+        # Decoder_master
+        out = recompute_stage(self, 3, self.decode_master, e1_x, e2_x, e3_x, e4_x, \
+                              e1_y, e2_y, e3_y, e4_y)
         return [out, out1, out2]
 
 
@@ -1,4 +1,5 @@
 from .layer_libs import ConvBN, ConvBNReLU, SeparableConvBNReLU, AuxLayer, SyncBatchNorm
 from .pyramid_pool import PPModule
 from .initialize import kaiming_normal_init, constant_init, normal_init
-from .attention import CAM, SAM, BAM, PAM, GatedAttentionLayer
\ No newline at end of file
+from .attention import CAM, SAM, BAM, PAM, GatedAttentionLayer
+from .recompute import check_recompute, recompute_stage
\ No newline at end of file
@@ -0,0 +1,36 @@
+try:
+    from paddle.distributed.fleet.utils import recompute
+except ImportError:
+    from paddle.distributed.fleet.utils.recompute import recompute
+
+
+def check_recompute(recompute_stages, num_stages):
+    """
+    Convert the recompute config of a model to a set of stage ids (starting from 1).
+    Args:
+        recompute_stages (bool|list|None): True means all stages, a list means the chosen stages.
+        num_stages (int): The number of stages which can be recomputed.
+    Returns:
+        set: The stage ids which will be recomputed.
+    """
+    if recompute_stages is None or recompute_stages is False:
+        return set()
+    if recompute_stages is True:
+        return set(range(1, num_stages + 1))
+    if not isinstance(recompute_stages, (list, tuple)):
+        raise TypeError('`recompute` must be bool or list, but it is {}.'.format(type(recompute_stages)))
+    for stage in recompute_stages:
+        if stage < 1 or stage > num_stages:
+            raise ValueError('The stage of `recompute` should be between 1 and {}, but it is {}.'
+                             .format(num_stages, stage))
+    return set(recompute_stages)
+
+
+def recompute_stage(layer, stage, function, *args):
+    """
+    Run `function` with activation recomputation if `stage` is chosen and `layer` is training.
+    The intermediate activations of the stage are dropped in forward and recomputed in backward.
+    """
+    if layer.training and stage in layer.recompute_stages:
+        return recompute(function, *args)
+    return function(*args)
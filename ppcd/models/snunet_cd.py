@@ -2,6 +2,7 @@ import paddle
 import paddle.nn as nn
 import paddle.nn.functional as F
 from ppcd.models.layers import SyncBatchNorm, kaiming_normal_init, CAM
+from ppcd.models.layers import check_recompute, recompute_stage
 
 
 class ConvolutionBlock(nn.Layer):
@@ -58,8 +59,9 @@ class Encoder(nn.Layer):
 
 
 class Decoder(nn.Layer):
-    def __init__(self, filters):
+    def __init__(self, filters, recompute=None):
         super(Decoder, self).__init__()
+        self.recompute_stages = check_recompute(recompute, 4)
         # upsample number 1
         self.conv01 = ConvolutionBlock(filters[0]*2+filters[1], filters[0], filters[0])
         self.conv11 = ConvolutionBlock(filters[1]*2+filters[2], filters[1], filters[1])
@@ -85,22 +87,41 @@ class Decoder(nn.Layer):
         self.conv04 = ConvolutionBlock(filters[0]*5+filters[1], filters[0], filters[0])
         self.up13 = UpSample(filters[1])
 
-    def forward(self, x_cont):
-        x_00, x_10, x_20, x_30, x_40 = x_cont
-        # upsample number 1
+    def stage1(self, x_00, x_10, x_20, x_30, x_40):
         x_01 = self.conv01(paddle.concat([x_00, self.up10(paddle.split(x_10, 2, axis=1)[-1])], axis=1))
         x_11 = self.conv11(paddle.concat([x_10, self.up20(paddle.split(x_20, 2, axis=1)[-1])], axis=1))
         x_21 = self.conv21(paddle.concat([x_20, self.up30(paddle.split(x_30, 2, axis=1)[-1])], axis=1))
         x_31 = self.conv31(paddle.concat([x_30, self.up40(x_40)], axis=1))
-        # upsample number 2
+        return x_01, x_11, x_21, x_31
+
+    def stage2(self, x_00, x_10, x_20, x_01, x_11, x_21, x_31):
         x_02 = self.conv02(paddle.concat([x_00, x_01, self.up11(x_11)], axis=1))
         x_12 = self.conv12(paddle.concat([x_10, x_11, self.up21(x_21)], axis=1))
         x_22 = self.conv22(paddle.concat([x_20, x_21, self.up31(x_31)], axis=1))
-        # upsample number 3
+        return x_02, x_12, x_22
+
+    def stage3(self, x_00, x_10, x_01, x_11, x_02, x_12, x_22):
         x_03 = self.conv03(paddle.concat([x_00, x_01, x_02, self.up12(x_12)], axis=1))
         x_13 = self.conv13(paddle.concat([x_10, x_11, x_12, self.up22(x_22)], axis=1))
-        # upsample number 4
+        return x_03, x_13
+
+    def stage4(self, x_00, x_01, x_02, x_03, x_13):
         x_04 = self.conv04(paddle.concat([x_00, x_01, x_02, x_03, self.up13(x_13)], axis=1))
+        return x_04
+
+    def forward(self, x_cont):
+        x_00, x_10, x_20, x_30, x_40 = x_cont
+        # upsample number 1
+        x_01, x_11, x_21, x_31 = recompute_stage(
+            self, 1, self.stage1, x_00, x_10, x_20, x_30, x_40)
+        # upsample number 2
+        x_02, x_12, x_22 = recompute_stage(
+            self, 2, self.stage2, x_00, x_10, x_20, x_01, x_11, x_21, x_31)
+        # upsample number 3
+        x_03, x_13 = recompute_stage(
+            self, 3, self.stage3, x_00, x_10, x_01, x_11, x_02, x_12, x_22)
+        # upsample number 4
+        x_04 = recompute_stage(self, 4, self.stage4, x_00, x_01, x_02, x_03, x_13)
         return x_01, x_02, x_03, x_04
 
 
@@ -114,14 +135,16 @@ class SNUNet(nn.Layer):
         in_channels (int, optional): Number of an image's channel.  Default: 3.
         out_channels (int, optional): The unique number of target classes.  Default: 2.
         is_ECAM (bool, optional): Use Channel Attention Module or not.  Default: True.
+        recompute (bool|list, optional): Recompute the activations of decoder stages (1-4) in backward
+            to save memory, True means all stages.  Default: None.
     """
-    def __init__(self, in_channels=3, out_channels=2, is_ECAM=True):
+    def __init__(self, in_channels=3, out_channels=2, is_ECAM=True, recompute=None):
         super(SNUNet, self).__init__()
         self.is_ECAM = is_ECAM
         map_num = 32
         filters = [map_num, map_num*2, map_num*4, map_num*8, map_num*16]
         self.encoder = Encoder(in_channels, filters)
-        self.decoder = Decoder(filters)
+        self.decoder = Decoder(filters, recompute=recompute)
         if is_ECAM:
             self.cam1 = CAM(filters[0], ratio=16//4)
             self.cam2 = CAM(filters[0]*4, ratio=16)
@@ -1,3 +1,4 @@
-from .tailor_base import random_out, slide_out, split_eval
+from .tailor_base import random_out, slide_out, split_eval, tiles_any, rasterize_polygons
 from .splicing import splicing_list
-from .geo_process import open_tif, tif2array, get_geoinfo, save_tif
\ No newline at end of file
+from .geo_process import open_tif, tif2array, get_geoinfo, save_tif
+from .geo_process import read_window, create_tif, write_window, read_polygons, TileWriter, merge_tiles
\ No newline at end of file
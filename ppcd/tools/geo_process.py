@@ -1,20 +1,24 @@
+import os
+import json
 import numpy as np
+from math import ceil
 try:
     try:
-        from osgeo import gdal
+        from osgeo import gdal, ogr
     except ImportError:
         import gdal
+        import ogr
     IPT_GDAL = True
 except:
     IPT_GDAL = False
 
 
-def open_tif(geoimg_path, to_np=False):
+def open_tif(geoimg_path, to_np=False, update=False):
     '''
-        打开tif文件
+        打开tif文件，update为True时可写
     '''
     if IPT_GDAL == True:
-        geoimg = gdal.Open(geoimg_path)
+        geoimg = gdal.Open(geoimg_path, gdal.GA_Update if update else gdal.GA_ReadOnly)
         if to_np == False:
             return geoimg
         else:
@@ -47,9 +51,9 @@ def get_geoinfo(geoimg):
         raise ImportError('can\'t import gdal!')
 
 
-def save_tif(img, geoinfo, save_path):
+def save_tif(img, geoinfo, save_path, nodata=None):
     '''
-        保存分割的图像并使其空间信息保持一致
+        保存分割的图像并使其空间信息保持一致，nodata不为None时写入NoData值
     '''
     if IPT_GDAL == True:
         driver = gdal.GetDriverByName('GTiff')
@@ -68,6 +72,206 @@ def save_tif(img, geoinfo, save_path):
         else:
             for i_c in range(C):
                 dataset.GetRasterBand(i_c + 1).WriteArray(img[:, :, i_c])
+        if nodata is not None:
+            for i_c in range(C):
+                dataset.GetRasterBand(i_c + 1).SetNoDataValue(nodata)
         del dataset  # 删除与tif的连接
     else:
-        raise ImportError('can\'t import gdal!')
\ No newline at end of file
+        raise ImportError('can\'t import gdal!')
+
+def read_window(geoimg, x, y, w, h):
+    '''
+        读取tif中的一个窗口，返回[h, w, c]
+    '''
+    if IPT_GDAL == True:
+        arr = geoimg.ReadAsArray(x, y, w, h)
+        if len(arr.shape) == 2:
+            return arr[:, :, np.newaxis]
+        return arr.transpose((1, 2, 0))
+    else:
+        raise ImportError('can\'t import gdal!')
+
+
+def create_tif(save_path, geoinfo, count=None, datatype='Float32', nodata=None):
+    '''
+        创建分块写入的tif，空间信息与geoinfo一致，datatype为GDAL的数据类型名，如'Byte'、'Float32'
+    '''
+    if IPT_GDAL == True:
+        driver = gdal.GetDriverByName('GTiff')
+        count = geoinfo['count'] if count is None else count
+        datatype = gdal.GetDataTypeByName(datatype)
+        dataset = driver.Create(
+            save_path,
+            geoinfo['xsize'],
+            geoinfo['ysize'],
+            count,
+            datatype,
+            options=['TILED=YES', 'BIGTIFF=IF_SAFER', 'SPARSE_OK=TRUE'])
+        dataset.SetProjection(geoinfo['proj'])
+        dataset.SetGeoTransform(geoinfo['geotrans'])
+        if nodata is not None:
+            for i_c in range(count):
+                dataset.GetRasterBand(i_c + 1).SetNoDataValue(nodata)
+        return dataset
+    else:
+        raise ImportError('can\'t import gdal!')
+
+
+def write_window(dataset, img, x, y):
+    '''
+        将[h, w, c]或[h, w]的图像写入tif的(x, y)处
+    '''
+    C = img.shape[-1] if len(img.shape) == 3 else 1
+    if C == 1:
+        dataset.GetRasterBand(1).WriteArray(img.reshape(img.shape[:2]), x, y)
+    else:
+        for i_c in range(C):
+            dataset.GetRasterBand(i_c + 1).WriteArray(img[:, :, i_c], x, y)
+
+
+def read_polygons(vector_path):
+    '''
+        读取矢量文件（shp/geojson等）中多边形的外环坐标，返回[[(x, y), ...], ...]
+    '''
+    if IPT_GDAL == True:
+        polygons = []
+        vector = ogr.Open(vector_path)
+        if vector is None:
+            raise ValueError('can\'t open {}!'.format(vector_path))
+        layer = vector.GetLayer()
+        for feature in layer:
+            geom = feature.GetGeometryRef()
+            if geom is None:
+                continue
+            parts = [geom.GetGeometryRef(i) for i in range(geom.GetGeometryCount())] \
+                    if geom.GetGeometryName() == 'MULTIPOLYGON' else [geom]
+            for part in parts:
+                ring = part.GetGeometryRef(0)  # 只使用外环
+                polygons.append([pt[:2] for pt in ring.GetPoints()])
+        return polygons
+    else:
+        raise ImportError('can\'t import gdal!')
+
+
+# 第index块在影像中的窗口 (x, y, w, h)，与slide_out的顺序一致
+def tile_window(index, c_size, raw_size):
+    col = ceil(raw_size[1] / c_size[1])
+    y = (index // col) * c_size[0]
+    x = (index % col) * c_size[1]
+    return x, y, min(c_size[1], raw_size[1] - x), min(c_size[0], raw_size[0] - y)
+
+
+def read_journal(journal_path):
+    '''
+        读取TileWriter的日志，返回参数头(dict)及已完成的块，日志不存在或参数头不完整时参数头为None
+    '''
+    if not os.path.exists(journal_path):
+        return None, set()
+    with open(journal_path, 'r') as f:
+        lines = f.readlines()
+    if len(lines) == 0 or not lines[0].endswith('\n'):
+        return None, set()
+    try:
+        head = json.loads(lines[0])
+    except ValueError:
+        return None, set()
+    done = set()
+    for line in lines[1:]:
+        # 中断时未写完的行没有换行符，不使用
+        if line.endswith('\n') and line.strip().isdigit():
+            done.add(int(line))
+    return head, done
+
+
+def merge_tiles(part_paths, save_path):
+    '''
+        按日志将多个TileWriter的结果（各自只完成了一部分块）合并为一个tif，各部分的参数头需要一致
+        Return：
+            missing (list): 所有部分都没有完成的块
+    '''
+    heads = []
+    dones = []
+    for part_path in part_paths:
+        head, done = read_journal(part_path + '.journal')
+        if head is None:
+            raise ValueError('{} has no valid journal!'.format(part_path))
+        heads.append(head)
+        dones.append(done)
+    if any(head != heads[0] for head in heads):
+        raise ValueError('The parts were predicted with different settings, they can\'t be merged!')
+    c_size, raw_size = heads[0]['c_size'], heads[0]['raw_size']
+    geoinfo = get_geoinfo(open_tif(part_paths[0]))
+    dataset = create_tif(save_path, geoinfo, count=1, datatype='Byte', nodata=heads[0]['nodata'])
+    merged = set()
+    for part_path, done in zip(part_paths, dones):
+        part = open_tif(part_path)
+        for index in sorted(done - merged):
+            x, y, w, h = tile_window(index, c_size, raw_size)
+            write_window(dataset, read_window(part, x, y, w, h), x, y)
+            merged.add(index)
+        part = None
+    dataset.FlushCache()
+    dataset = None
+    total = ceil(raw_size[0] / c_size[0]) * ceil(raw_size[1] / c_size[1])
+    return [index for index in range(total) if index not in merged]
+
+
+class TileWriter(object):
+    '''
+        按块写入tif并记录已完成的块，中断后重新运行时跳过已完成的块
+        完成的块索引记录在 save_path + '.journal' 中，块先写入tif并fsync到磁盘后再写入日志
+        日志的第一行为参数头（header及块大小、影像大小），与本次运行不一致时重新开始，不会使用旧的结果
+        Args:
+            save_path (str): 结果保存路径 (.tif)
+            geoinfo (dict): 空间信息
+            c_size (list): 块大小[H, W]
+            nodata (int/None): NoData值，默认为None
+            valid_mask (nd.array/None): 有效像素的掩膜[H, W]，无效像素写入fill_value，默认为None
+            fill_value (int): 无效像素的填充值，默认为0
+            header (dict/None): 影响结果的参数（如模型哈希、阈值），需要可以转为json，默认为None
+    '''
+    def __init__(self, save_path, geoinfo, c_size, nodata=None, valid_mask=None, fill_value=0, header=None):
+        self.journal_path = save_path + '.journal'
+        self.c_size = c_size
+        self.raw_size = [geoinfo['ysize'], geoinfo['xsize']]
+        self.valid_mask = valid_mask
+        self.fill_value = fill_value
+        self.done = set()
+        head = dict(header or {}, c_size=list(c_size), raw_size=self.raw_size, nodata=nodata)
+        head_line = json.dumps(head, sort_keys=True) + '\n'
+        old_head, done = read_journal(self.journal_path)
+        if os.path.exists(save_path) and old_head == json.loads(head_line):
+            self.dataset = open_tif(save_path, update=True)
+            self.done = done
+        else:
+            if os.path.exists(self.journal_path):
+                print('[TileWriter] the journal of {} doesn\'t match, restart.'.format(save_path))
+            self.dataset = create_tif(save_path, geoinfo, count=1, datatype='Byte', nodata=nodata)
+            self.dataset.FlushCache()
+            with open(self.journal_path, 'w') as f:
+                f.write(head_line)
+                f.flush()
+                os.fsync(f.fileno())
+        # GDAL不提供文件描述符，另外打开一个用于fsync
+        self.fd = os.open(save_path, os.O_RDWR)
+        self.journal = open(self.journal_path, 'a')
+
+    def write(self, index, img):
+        x, y, w, h = tile_window(index, self.c_size, self.raw_size)
+        img = np.array(img[:h, :w])
+        if self.valid_mask is not None:
+            img[~self.valid_mask[y:y+h, x:x+w]] = self.fill_value
+        write_window(self.dataset, img, x, y)
+        self.dataset.FlushCache()
+        os.fsync(self.fd)
+        self.journal.write(str(index) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.done.add(index)
+
+    def close(self):
+        self.dataset.FlushCache()
+        self.dataset = None
+        os.fsync(self.fd)
+        os.close(self.fd)
+        self.journal.close()
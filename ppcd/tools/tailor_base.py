@@ -1,5 +1,6 @@
 import sys
 import random
+import cv2
 import numpy as np
 from math import ceil
 
@@ -47,10 +48,10 @@ def slide_out(bimgs, row, col, index, c_size=None):
         for i in range(len(bimgs)):
             bimg = bimgs[i]
             if len(bimg.shape) == 2:
-                tmp = np.zeros((h_new, w_new))
+                tmp = np.zeros((h_new, w_new), dtype=bimg.dtype)
                 tmp[:bimg.shape[0], :bimg.shape[1]] = bimg
             else:
-                tmp = np.zeros((h_new, w_new, bimg.shape[-1]))
+                tmp = np.zeros((h_new, w_new, bimg.shape[-1]), dtype=bimg.dtype)
                 tmp[:bimg.shape[0], :bimg.shape[1], :] = bimg
             tmps.append(tmp)
         H, W = tmps[0].shape[:2]
@@ -110,4 +111,44 @@ def split_eval(bimgs, rate=0.8, direction='H', geoinfo=None):
         val_geoinfo['geotrans'] = (
             minx + int(W * rate * xres), xres, xskew, maxy, yskew, yres) if direction == 'V' \
             else (minx, xres, xskew, maxy + int(H * rate * yres), yskew, yres)
-        return train_imgs, val_imgs, train_geoinfo, val_geoinfo
\ No newline at end of file
+        return train_imgs, val_imgs, train_geoinfo, val_geoinfo
+
+
+def tiles_any(mask, c_size):
+    '''
+        将[H, W]的掩膜按c_size分块，返回每块（按slide_out的顺序）是否有非0像素
+    '''
+    H, W = mask.shape[:2]
+    row = ceil(H / c_size[0])
+    col = ceil(W / c_size[1])
+    tmp = np.zeros((row * c_size[0], col * c_size[1]), dtype='bool')
+    tmp[:H, :W] = mask
+    return tmp.reshape(row, c_size[0], col, c_size[1]).any(axis=(1, 3)).reshape(-1)
+
+
+def rasterize_polygons(polygons, raw_size, c_size, geoinfo=None, cells=16):
+    '''
+        将多边形栅格化为块的掩膜，每块划分为cells x cells个格网，与多边形相交的块为True
+        geoinfo不为None时多边形为地理坐标，否则为像素坐标(x, y)
+    '''
+    H, W = raw_size
+    row = ceil(H / c_size[0])
+    col = ceil(W / c_size[1])
+    cell_h = c_size[0] / cells
+    cell_w = c_size[1] / cells
+    grid = np.zeros((row * cells, col * cells), dtype=np.uint8)
+    pts_list = []
+    for polygon in polygons:
+        pts = np.array(polygon, dtype='float64')[:, :2]
+        if geoinfo is not None:
+            minx, xres, _, maxy, _, yres = geoinfo['geotrans']
+            pts = np.stack([(pts[:, 0] - minx) / xres, (pts[:, 1] - maxy) / yres], axis=1)
+        pts = pts / np.array([cell_w, cell_h])
+        pts_list.append(np.round(pts * 16).astype(np.int32))  # 4位小数精度
+    if len(pts_list) > 0:
+        # 逐个多边形填充，一次填充多个时重叠区域按奇偶规则会被留空
+        for pts in pts_list:
+            cv2.fillPoly(grid, [pts], 1, shift=4)
+        # 向外扩展一个格网，保证与多边形边缘相交的块不被漏掉
+        grid = cv2.dilate(grid, np.ones((3, 3), np.uint8))
+    return grid.reshape(row, cells, col, cells).any(axis=(1, 3)).reshape(-1)
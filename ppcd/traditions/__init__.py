@@ -1,3 +1,6 @@
 from .cva import CVA
 from .basics import BaseCompute
-from .mrf import MRF
\ No newline at end of file
+from .mrf import MRF
+from .tiled import Tiled_CVA, Tiled_BaseCompute
+from .threshold import Threshold, Tiled_Threshold, hist_threshold
+from .tensor_ops import CVA_Tensor, BaseCompute_Tensor, MRF_Tensor, TraditionModel
\ No newline at end of file
@@ -1,70 +1,101 @@
 import numpy as np
 import cv2 as cv
+from multiprocessing import Pool
+from .tiled import block_windows
 
 
-def MRF(img, label, max_iter, cluster_num):
-    iter = 0
+# 8邻域中同类个数为0-8时的log(p_c)，个数为0时p_c取0.0001
+LOG_PC = np.log(np.array([0.0001] + [k / 8. for k in range(1, 9)], dtype=np.float32))
 
-    f_u = np.array([0, 1, 0, 0, 0, 0, 0, 0, 0]).reshape(3, 3)
-    f_d = np.array([0, 0, 0, 0, 0, 0, 0, 1, 0]).reshape(3, 3)
-    f_l = np.array([0, 0, 0, 1, 0, 0, 0, 0, 0]).reshape(3, 3)
-    f_r = np.array([0, 0, 0, 0, 0, 1, 0, 0, 0]).reshape(3, 3)
-    f_ul = np.array([1, 0, 0, 0, 0, 0, 0, 0, 0]).reshape(3, 3)
-    f_ur = np.array([0, 0, 1, 0, 0, 0, 0, 0, 0]).reshape(3, 3)
-    f_dl = np.array([0, 0, 0, 0, 0, 0, 1, 0, 0]).reshape(3, 3)
-    f_dr = np.array([0, 0, 0, 0, 0, 0, 0, 0, 1]).reshape(3, 3)
+# 分块时每个进程保存一份原图
+mrf_data = {}
 
-    while iter < max_iter:
-        iter = iter + 1
-        # print(iter)
 
-        label_u = cv.filter2D(np.array(label, dtype=np.uint8), -1, f_u)
-        label_d = cv.filter2D(np.array(label, dtype=np.uint8), -1, f_d)
-        label_l = cv.filter2D(np.array(label, dtype=np.uint8), -1, f_l)
-        label_r = cv.filter2D(np.array(label, dtype=np.uint8), -1, f_r)
-        label_ul = cv.filter2D(np.array(label, dtype=np.uint8), -1, f_ul)
-        label_ur = cv.filter2D(np.array(label, dtype=np.uint8), -1, f_ur)
-        label_dl = cv.filter2D(np.array(label, dtype=np.uint8), -1, f_dl)
-        label_dr = cv.filter2D(np.array(label, dtype=np.uint8), -1, f_dr)
-        m, n = label.shape
-        p_c = np.zeros((cluster_num, m, n))
+def init_mrf_worker(img):
+    mrf_data['img'] = img
 
-        for i in range(cluster_num):
-            label_i = (i + 1) * np.ones((m, n))
-            u_T = 1 * np.logical_not(label_i - label_u)
-            d_T = 1 * np.logical_not(label_i - label_d)
-            l_T = 1 * np.logical_not(label_i - label_l)
-            r_T = 1 * np.logical_not(label_i - label_r)
-            ul_T = 1 * np.logical_not(label_i - label_ul)
-            ur_T = 1 * np.logical_not(label_i - label_ur)
-            dl_T = 1 * np.logical_not(label_i - label_dl)
-            dr_T = 1 * np.logical_not(label_i - label_dr)
-            temp = u_T + d_T + l_T + r_T + ul_T + ur_T + dl_T + dr_T
 
-            p_c[i, :] = (1.0 / 8) * temp
+# 各类的均值和方差，没有像素的类为nan
+def cluster_stats(img, label, cluster_num):
+    lab = label.ravel()
+    val = img.ravel()
+    nums = np.bincount(lab, minlength=cluster_num + 1)[1:cluster_num + 1]
+    sums = np.bincount(lab, weights=val, minlength=cluster_num + 1)[1:cluster_num + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu = sums / nums
+        # 两遍计算方差，避免E[x^2]-E[x]^2的精度损失
+        mu_pix = np.zeros(max(lab.max(), cluster_num) + 1)
+        mu_pix[1:cluster_num + 1] = np.nan_to_num(mu)
+        sq = np.bincount(lab, weights=(val - mu_pix[lab]) ** 2, minlength=cluster_num + 1)
+        sigma = sq[1:cluster_num + 1] / nums
+    return mu.astype(np.float32), sigma.astype(np.float32)
 
-        p_c[p_c == 0] = 0.0001
 
-        mu = np.zeros((1, cluster_num))
-        sigma = np.zeros((1, cluster_num))
+# 根据带1像素外框的标签更新一块的标签，逐像素计算，分块与整图的结果相同
+def mrf_update(img, label_pad, mu, sigma, cluster_num):
+    m, n = img.shape
+    best = np.full((m, n), -np.inf, dtype=np.float32)
+    label = np.ones((m, n), dtype=label_pad.dtype)
+    with np.errstate(divide='ignore', invalid='ignore'):
         for i in range(cluster_num):
-            index = np.where(label == (i + 1))
-            data_c = img[index]
-            mu[0, i] = np.mean(data_c)
-            sigma[0, i] = np.var(data_c)
+            # 3x3求和减去中心即为8邻域中的同类个数
+            one_hot = (label_pad == (i + 1)).astype(np.float32)
+            count = cv.boxFilter(one_hot, -1, (3, 3), normalize=False)[1:-1, 1:-1] - one_hot[1:-1, 1:-1]
+            log_pc = LOG_PC[np.rint(count).astype(np.int64)]
+            log_psc = -0.5 * np.log(2. * np.pi * sigma[i]) - (img - mu[i]) ** 2 / (2 * sigma[i])
+            X_out = log_pc + log_psc
+            better = X_out > best  # 与argmax一致，相等时取前面的类
+            best[better] = X_out[better]
+            label[better] = i + 1
+    return label
 
-        p_sc = np.zeros((cluster_num, m, n))
-        one_a = np.ones((m, n))
 
-        for j in range(cluster_num):
-            MU = mu[0, j] * one_a
-            p_sc[j, :] = (1. / np.sqrt(2. * np.pi * sigma[0, j])) * np.exp(-1. * ((img - MU) ** 2) / (2 * sigma[0, j]))
+def update_tile(args):
+    window, label_pad, mu, sigma, cluster_num = args
+    x, y, w, h = window
+    return window, mrf_update(mrf_data['img'][y:y+h, x:x+w], label_pad, mu, sigma, cluster_num)
 
-        X_out = np.log(p_c) + np.log(p_sc)
-        label_c = X_out.reshape(cluster_num, m*n)
-        label_c_t = label_c.T
-        label_m = np.argmax(label_c_t, axis=1)
-        label_m = label_m + np.ones(label_m.shape)  
-        label = label_m.reshape(m, n)
 
-    return label
\ No newline at end of file
+def MRF(img, label, max_iter, cluster_num, block_size=None, num_workers=1):
+    '''
+        马尔科夫随机场后处理，邻域项为8邻域中同类的比例，数据项为各类的高斯分布，均在log域中计算
+        Args:
+            img (nd.array): 原图（H, W）
+            label (nd.array): 初始的标签（H, W），类别为1 - cluster_num
+            max_iter (int): 迭代次数
+            cluster_num (int): 类别数
+            block_size (int/None, 可选): 分块大小，为None时整图计算，默认为None
+            num_workers (int, 可选): 分块计算的进程数，默认为1
+        Return：
+            label (nd.array): 迭代后的标签（H, W）
+    '''
+    img = np.asarray(img, dtype=np.float32)
+    label = np.asarray(label).astype(np.uint8 if cluster_num < 256 else np.int32)
+    m, n = label.shape
+    windows = block_windows(n, m, block_size) if block_size is not None else None
+    pool = None
+    if windows is not None and num_workers > 1:
+        pool = Pool(num_workers, initializer=init_mrf_worker, initargs=(img, ))
+    else:
+        init_mrf_worker(img)
+    try:
+        for _ in range(max_iter):
+            # 全局统计量在整图上计算，保证分块结果与整图一致
+            mu, sigma = cluster_stats(img, label, cluster_num)
+            label_pad = cv.copyMakeBorder(label, 1, 1, 1, 1, cv.BORDER_REFLECT_101)
+            if windows is None:
+                label = mrf_update(img, label_pad, mu, sigma, cluster_num)
+                continue
+            tasks = [((x, y, w, h), label_pad[y:y+h+2, x:x+w+2], mu, sigma, cluster_num) \
+                     for x, y, w, h in windows]
+            results = pool.imap_unordered(update_tile, tasks) if pool is not None else map(update_tile, tasks)
+            new_label = np.empty_like(label)
+            for (x, y, w, h), tile in results:
+                new_label[y:y+h, x:x+w] = tile
+            label = new_label
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        mrf_data.clear()
+    return label.astype(np.float64)
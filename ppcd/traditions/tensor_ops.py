@@ -0,0 +1,149 @@
+import numpy as np
+import paddle
+import paddle.nn as nn
+import paddle.nn.functional as F
+
+
+# 合并为单通道，3通道与cv2.COLOR_RGB2GRAY的权重一致，其余取各波段均值，输入为[N, C, H, W]
+def to_single_tensor(img):
+    C = img.shape[1]
+    if C == 3:
+        weight = paddle.to_tensor([0.299, 0.587, 0.114], dtype=img.dtype).reshape([1, 3, 1, 1])
+        return paddle.sum(img * weight, axis=1, keepdim=True)
+    elif C != 1:
+        return paddle.mean(img, axis=1, keepdim=True)
+    return img
+
+
+def check_modes(T1, T2, out_mode):
+    if out_mode != 'single' and out_mode != 'keep':
+        raise ValueError("out_mode must be 'single' or 'keep'!")
+    if T1.shape != T2.shape:
+        raise ValueError('The shape of T1 and T2 should be equal: {} != {}.'.format(T1.shape, T2.shape))
+    T1 = T1.astype('float32')
+    T2 = T2.astype('float32')
+    if out_mode == 'single':
+        T1 = to_single_tensor(T1)
+        T2 = to_single_tensor(T2)
+    return T1, T2
+
+
+def CVA_Tensor(T1, T2, out_mode='single'):
+    '''
+        批量计算CVA，每个样本每个通道单独归一化，计算方法与逐对调用CVA相同
+        （'single'时灰度在浮点上转换，与cv2对uint8图像的取整结果略有差异）
+        Args:
+            T1 (Tensor): 时刻一的图像 [N, C, H, W]
+            T2 (Tensor): 时刻二的图像 [N, C, H, W]
+            out_mode (str, 可选): 返回图像的通道数，只能为'single'或'keep'，默认为'single'
+        Return：
+            Icva (Tensor): 计算得到的向量图像 [N, 1/C, H, W]
+    '''
+    T1, T2 = check_modes(T1, T2, out_mode)
+    diff_str = T2 - T1
+    delta_V = paddle.sqrt(paddle.sum(diff_str ** 2, axis=[2, 3], keepdim=True))
+    diff_dir = diff_str / (paddle.abs(delta_V) + 1e-12)
+    d_min = paddle.min(diff_dir, axis=[2, 3], keepdim=True)
+    d_max = paddle.max(diff_dir, axis=[2, 3], keepdim=True)
+    return (diff_dir - d_min) / (d_max - d_min + 1e-12)
+
+
+def BaseCompute_Tensor(T1, T2, out_mode='single', mode='s'):
+    '''
+        批量对两期图像进行做差/除运算
+        Args:
+            T1 (Tensor): 时刻一的图像 [N, C, H, W]
+            T2 (Tensor): 时刻二的图像 [N, C, H, W]
+            out_mode (str, 可选): 返回图像的通道数，只能为'single'或'keep'，默认为'single'
+            mode (str, 可选): 's'为做差，'d'为做除，默认为's'
+        Return：
+            diff (Tensor): [N, 1/C, H, W]
+    '''
+    if mode != 's' and mode != 'd':
+        raise ValueError("mode must be 's'(subtraction) or 'd'(division)!")
+    T1, T2 = check_modes(T1, T2, out_mode)
+    if mode == 's':
+        return T2 - T1
+    else:
+        return T2 / (T1 + 1e-12)
+
+
+def MRF_Tensor(img, label, max_iter, cluster_num):
+    '''
+        批量的马尔科夫随机场后处理，每个样本单独统计各类的均值和方差，迭代规则与逐张调用MRF相同，
+        float32的累加顺序及输入的灰度转换不同，结果可能在少量像素上不一致
+        Args:
+            img (Tensor): 原图 [N, 1, H, W] 或 [N, H, W]
+            label (Tensor): 初始的标签，形状同img，类别为1 - cluster_num
+            max_iter (int): 迭代次数
+            cluster_num (int): 类别数
+        Return：
+            label (Tensor): 迭代后的标签 [N, 1, H, W]（int64）
+    '''
+    N, H, W = img.shape[0], img.shape[-2], img.shape[-1]
+    if len(img.shape) == 4 and img.shape[1] != 1:
+        raise ValueError('MRF_Tensor: img should be single channel, but it has {} channels.'
+                         .format(img.shape[1]))
+    img = img.astype('float32').reshape([N, 1, H, W])
+    label = label.astype('int64').reshape([N, 1, H, W])
+    classes = paddle.arange(1, cluster_num + 1, dtype='int64').reshape([1, cluster_num, 1, 1])
+    # 3x3去掉中心，逐通道卷积得到8邻域中每一类的个数
+    kernel = np.ones([cluster_num, 1, 3, 3], dtype='float32')
+    kernel[:, :, 1, 1] = 0
+    kernel = paddle.to_tensor(kernel)
+    for _ in range(max_iter):
+        one_hot = (label == classes).astype('float32')
+        count = F.conv2d(F.pad(one_hot, [1, 1, 1, 1], mode='reflect'), kernel, groups=cluster_num)
+        p_c = count / 8.
+        p_c = paddle.where(p_c == 0, paddle.full_like(p_c, 0.0001), p_c)
+        num = paddle.sum(one_hot, axis=[2, 3], keepdim=True)
+        mu = paddle.sum(one_hot * img, axis=[2, 3], keepdim=True) / num
+        sigma = paddle.sum(one_hot * (img - mu) ** 2, axis=[2, 3], keepdim=True) / num
+        X_out = paddle.log(p_c) - 0.5 * paddle.log(2. * np.pi * sigma) - \
+                (img - mu) ** 2 / (2 * sigma)
+        # 没有像素的类不参与
+        X_out = paddle.where(paddle.isnan(X_out), paddle.full_like(X_out, -np.inf), X_out)
+        label = paddle.argmax(X_out, axis=1, keepdim=True) + 1
+    return label
+
+
+class TraditionModel(nn.Layer):
+    """
+    将传统方法包装为网络，输入为DataLoader的图像列表，可以直接用于Eval(losses=None)，
+    与深度模型使用相同的批处理流程和精度评价
+    Args:
+        method (str): 变化检测方法，可选参数为 ['cva', 's', 'd']，分别为CVA的变化强度（各通道差值的L2范数）、
+                      做差、做除，默认为'cva'
+        threshold (float): MRF初始化标签时的阈值，默认为0.5
+        mrf_iter (int): MRF的迭代次数，为0时输出单通道的差异图（由Eval的threshold二值化），
+                        大于0时输出两类的结果，默认为0
+        normalize (bool): 做差/做除时是否将每个样本的绝对差异归一化到[0, 1]，CVA的变化强度始终归一化，默认为True
+    """
+    methods = ['cva', 's', 'd']
+    def __init__(self, method='cva', threshold=0.5, mrf_iter=0, normalize=True):
+        super(TraditionModel, self).__init__()
+        assert method in self.methods, 'method should be one of {}.'.format(self.methods)
+        self.method = method
+        self.threshold = threshold
+        self.mrf_iter = mrf_iter
+        self.normalize = normalize
+
+    def forward(self, images):
+        T1, T2 = images[0], images[1]
+        if self.method == 'cva':
+            # 变化强度，未变化的像素为0（CVA_Tensor为变化方向，未变化的像素在中间）
+            diff = BaseCompute_Tensor(T1, T2, 'keep', 's')
+            score = paddle.sqrt(paddle.sum(diff ** 2, axis=1, keepdim=True))
+        else:
+            score = BaseCompute_Tensor(T1, T2, 'single', self.method)
+            if self.normalize:
+                score = paddle.abs(score - 1.) if self.method == 'd' else paddle.abs(score)
+        if self.method == 'cva' or self.normalize:
+            s_min = paddle.min(score, axis=[2, 3], keepdim=True)
+            s_max = paddle.max(score, axis=[2, 3], keepdim=True)
+            score = (score - s_min) / (s_max - s_min + 1e-12)
+        if self.mrf_iter <= 0:
+            return [score]
+        label = (score > self.threshold).astype('int64') + 1
+        label = MRF_Tensor(score, label, self.mrf_iter, 2)
+        return [F.one_hot(label.squeeze(1) - 1, 2).transpose([0, 3, 1, 2])]
@@ -0,0 +1,209 @@
+import numpy as np
+from multiprocessing import Pool
+from ppcd.tools import open_tif, get_geoinfo, read_window, create_tif, write_window
+from .tiled import block_windows
+
+
+METHODS = ['otsu', 'kmeans', 'em']
+
+# 每个进程打开一次差异影像
+thr_data = {}
+
+
+def init_thr_worker(img_path):
+    thr_data['img'] = open_tif(img_path)
+
+
+# ----- 基于直方图的阈值 -----
+def otsu_hist(hist, centers):
+    w0 = np.cumsum(hist)
+    m0 = np.cumsum(hist * centers)
+    total, m_total = w0[-1], m0[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_b = (m_total * w0 - total * m0) ** 2 / (w0 * (total - w0))
+    k = np.argmax(np.nan_to_num(sigma_b[:-1], nan=-1.))
+    return (centers[k] + centers[k + 1]) / 2.
+
+
+def kmeans_hist(hist, centers, max_iter=100):
+    t = otsu_hist(hist, centers)
+    for _ in range(max_iter):
+        low = centers <= t
+        if hist[low].sum() == 0 or hist[~low].sum() == 0:
+            break
+        m0 = np.average(centers[low], weights=hist[low])
+        m1 = np.average(centers[~low], weights=hist[~low])
+        new_t = (m0 + m1) / 2.
+        if abs(new_t - t) < 1e-12:
+            break
+        t = new_t
+    return t
+
+
+def em_hist(hist, centers, max_iter=100):
+    # 两个高斯分量的EM，以Otsu的划分初始化
+    t = otsu_hist(hist, centers)
+    low = centers <= t
+    if hist[low].sum() == 0 or hist[~low].sum() == 0:
+        return t
+    total = hist.sum()
+    pi = np.array([hist[low].sum(), hist[~low].sum()]) / total
+    mu = np.array([np.average(centers[low], weights=hist[low]),
+                   np.average(centers[~low], weights=hist[~low])])
+    eps = (centers[1] - centers[0]) ** 2 / 12. if len(centers) > 1 else 1e-12
+    var = np.array([np.average((centers[low] - mu[0]) ** 2, weights=hist[low]),
+                    np.average((centers[~low] - mu[1]) ** 2, weights=hist[~low])]) + eps
+    for _ in range(max_iter):
+        log_p = np.log(pi)[:, None] - 0.5 * np.log(2 * np.pi * var)[:, None] - \
+                (centers[None, :] - mu[:, None]) ** 2 / (2 * var[:, None])
+        log_p -= log_p.max(axis=0, keepdims=True)
+        resp = np.exp(log_p)
+        resp /= resp.sum(axis=0, keepdims=True)
+        nk = (resp * hist).sum(axis=1) + 1e-12
+        new_mu = (resp * hist * centers).sum(axis=1) / nk
+        var = (resp * hist * (centers[None, :] - new_mu[:, None]) ** 2).sum(axis=1) / nk + eps
+        pi = nk / nk.sum()
+        if np.max(np.abs(new_mu - mu)) < 1e-12:
+            mu = new_mu
+            break
+        mu = new_mu
+    # 两个分量的后验相等处为阈值
+    lo, hi = np.argsort(mu)
+    log_p = np.log(pi)[:, None] - 0.5 * np.log(2 * np.pi * var)[:, None] - \
+            (centers[None, :] - mu[:, None]) ** 2 / (2 * var[:, None])
+    between = (centers >= mu[lo]) & (centers <= mu[hi]) & (log_p[hi] >= log_p[lo])
+    if not between.any():
+        return (mu[lo] + mu[hi]) / 2.
+    return centers[np.argmax(between)]
+
+
+def hist_threshold(hist, edges, method='otsu', max_iter=100):
+    '''
+        根据直方图计算变化/未变化的阈值
+        Args:
+            hist (nd.array): 直方图计数
+            edges (nd.array): 直方图的边界，长度为len(hist) + 1
+            method (str, 可选): 阈值方法，可选参数为 ['otsu', 'kmeans', 'em']，默认为'otsu'
+            max_iter (int, 可选): kmeans/em的最大迭代次数，默认为100
+        Return：
+            threshold (float): 阈值，大于阈值的为变化
+    '''
+    if method not in METHODS:
+        raise ValueError('method should be one of {}.'.format(METHODS))
+    hist = np.asarray(hist, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.float64)
+    centers = (edges[:-1] + edges[1:]) / 2.
+    if method == 'otsu':
+        return float(otsu_hist(hist, centers))
+    elif method == 'kmeans':
+        return float(kmeans_hist(hist, centers, max_iter))
+    else:
+        return float(em_hist(hist, centers, max_iter))
+
+
+def Threshold(img, method='otsu', bins=256, abs_value=False):
+    '''
+        对CVA/BaseCompute得到的差异图像进行无监督的二值化
+        Args:
+            img (nd.array): 差异图像（H, W）或（H, W, C），多通道时每个通道单独计算阈值
+            method (str, 可选): 阈值方法，可选参数为 ['otsu', 'kmeans', 'em']，默认为'otsu'
+            bins (int, 可选): 直方图的分组数，默认为256
+            abs_value (bool, 可选): 是否对差异取绝对值，做差的结果两端均为变化时使用，默认为False
+        Return：
+            bin_img (nd.array): 二值图像，变化为255（uint8）
+            thresholds (list): 每个通道的阈值
+    '''
+    img = np.abs(img) if abs_value else img
+    img = img if len(img.shape) == 3 else img[:, :, np.newaxis]
+    bin_img = np.zeros(img.shape, dtype='uint8')
+    thresholds = []
+    for c in range(img.shape[-1]):
+        band = img[:, :, c]
+        valid = band[np.isfinite(band)]
+        hist, edges = np.histogram(valid, bins=bins)
+        thr = hist_threshold(hist, edges, method)
+        bin_img[:, :, c][band > thr] = 255
+        thresholds.append(thr)
+    return bin_img.squeeze(axis=-1) if bin_img.shape[-1] == 1 else bin_img, thresholds
+
+
+# ----- 分块计算 -----
+def read_block(window, abs_value):
+    x, y, w, h = window
+    block = read_window(thr_data['img'], x, y, w, h).astype('float64')
+    return np.abs(block) if abs_value else block
+
+
+def block_range(args):
+    window, abs_value = args
+    block = read_block(window, abs_value)
+    block = np.where(np.isfinite(block), block, np.nan)
+    return np.nanmin(block, axis=(0, 1)), np.nanmax(block, axis=(0, 1))
+
+
+def block_hist(args):
+    window, abs_value, bins, ranges = args
+    block = read_block(window, abs_value)
+    hists = []
+    for c in range(block.shape[-1]):
+        band = block[:, :, c]
+        hists.append(np.histogram(band[np.isfinite(band)], bins=bins, range=ranges[c])[0])
+    return np.stack(hists)
+
+
+def block_binarize(args):
+    window, abs_value, thresholds = args
+    block = read_block(window, abs_value)
+    return window, ((block > np.array(thresholds)) * 255).astype('uint8')
+
+
+def Tiled_Threshold(img_path, save_path, method='otsu', bins=1024, abs_value=False, \
+                    value_range=None, block_size=1024, num_workers=4):
+    '''
+        分块对超大差异影像（如Tiled_CVA的结果）进行无监督的二值化，不需要将整幅影像读入内存。
+        各进程分块统计直方图后合并为全局直方图计算阈值，再分块二值化写入GeoTIFF。
+        Args:
+            img_path (str): 差异影像路径，多波段时每个波段单独计算阈值
+            save_path (str): 二值结果保存路径 (.tif)，变化为255（Byte）
+            method (str, 可选): 阈值方法，可选参数为 ['otsu', 'kmeans', 'em']，默认为'otsu'
+            bins (int, 可选): 直方图的分组数，默认为1024
+            abs_value (bool, 可选): 是否对差异取绝对值，默认为False
+            value_range (list/None, 可选): 直方图的范围[min, max]，为None时多读一遍影像统计，默认为None
+            block_size (int, 可选): 分块大小，默认为1024
+            num_workers (int, 可选): 计算的进程数，默认为4
+        Return：
+            thresholds (list): 每个波段的阈值
+    '''
+    if method not in METHODS:
+        raise ValueError('method should be one of {}.'.format(METHODS))
+    if value_range is not None and len(value_range) != 2:
+        raise ValueError('value_range should include 2 elements, but it is {}.'.format(value_range))
+    geoinfo = get_geoinfo(open_tif(img_path))
+    count = geoinfo['count']
+    windows = block_windows(geoinfo['xsize'], geoinfo['ysize'], block_size)
+    with Pool(num_workers, initializer=init_thr_worker, initargs=(img_path, )) as pool:
+        if value_range is None:
+            v_min = np.full([count], np.inf)
+            v_max = np.full([count], -np.inf)
+            for b_min, b_max in pool.imap_unordered(block_range, [(w, abs_value) for w in windows]):
+                v_min = np.fmin(v_min, b_min)
+                v_max = np.fmax(v_max, b_max)
+            ranges = [(v_min[c], v_max[c]) if v_max[c] > v_min[c] else (v_min[c], v_min[c] + 1) \
+                      for c in range(count)]
+        else:
+            ranges = [tuple(value_range)] * count
+        # 第一遍：分块直方图合并为全局直方图
+        hist = np.zeros([count, bins], dtype=np.int64)
+        tasks = [(w, abs_value, bins, ranges) for w in windows]
+        for b_hist in pool.imap_unordered(block_hist, tasks):
+            hist += b_hist
+        thresholds = [hist_threshold(hist[c], np.linspace(ranges[c][0], ranges[c][1], bins + 1), method) \
+                      for c in range(count)]
+        # 第二遍：分块二值化
+        dataset = create_tif(save_path, geoinfo, datatype='Byte')
+        for window, block in pool.imap_unordered(block_binarize, [(w, abs_value, thresholds) for w in windows]):
+            write_window(dataset, block, window[0], window[1])
+        dataset.FlushCache()
+        del dataset
+    print('[Tiled] thresholds: {}, result saved in: {}'.format(thresholds, save_path))
+    return thresholds
@@ -0,0 +1,152 @@
+import numpy as np
+import cv2
+from multiprocessing import Pool
+from ppcd.tools import open_tif, get_geoinfo, read_window, create_tif, write_window
+
+
+# 每个进程打开一次两期影像
+worker_data = {}
+
+
+def init_worker(t1_path, t2_path):
+    worker_data['T1'] = open_tif(t1_path)
+    worker_data['T2'] = open_tif(t2_path)
+
+
+# 按block_size划分窗口 (x, y, w, h)
+def block_windows(xsize, ysize, block_size):
+    windows = []
+    for y in range(0, ysize, block_size):
+        for x in range(0, xsize, block_size):
+            windows.append((x, y, min(block_size, xsize - x), min(block_size, ysize - y)))
+    return windows
+
+
+# 合并为单通道，3通道按RGB转灰度，其余取各波段均值
+def to_single(img):
+    C = img.shape[-1]
+    if C == 3:
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)[:, :, np.newaxis]
+    elif C != 1:
+        return np.mean(img, axis=2, keepdims=True)
+    return img
+
+
+# 一个窗口的两期差值 [h, w, c]，mode: s = subtraction, d = division
+def block_diff(window, out_mode, mode):
+    x, y, w, h = window
+    gt1 = read_window(worker_data['T1'], x, y, w, h).astype('float32')
+    gt2 = read_window(worker_data['T2'], x, y, w, h).astype('float32')
+    if out_mode == 'single':
+        gt1 = to_single(gt1)
+        gt2 = to_single(gt2)
+    if mode == 's':
+        return gt2 - gt1
+    else:
+        return gt2 / (gt1 + 1e-12)
+
+
+# 第一遍：每个窗口各通道的最小值、最大值及平方和
+def block_stats(args):
+    window, out_mode, mode = args
+    diff = block_diff(window, out_mode, mode).astype('float64')
+    return (np.min(diff, axis=(0, 1)), np.max(diff, axis=(0, 1)), np.sum(diff ** 2, axis=(0, 1)))
+
+
+# 第二遍：按全局统计量归一化
+def block_normalize(args):
+    window, out_mode, mode, stats = args
+    diff = block_diff(window, out_mode, mode)
+    if stats is not None:
+        d_min, d_max, delta_V = stats
+        if delta_V is not None:  # CVA的向量方向变化
+            scale = np.abs(delta_V) + 1e-12
+            diff = diff / scale
+            d_min = d_min / scale
+            d_max = d_max / scale
+        diff = (diff - d_min) / (d_max - d_min + 1e-12)
+    return window, diff.astype('float32')
+
+
+def check_inputs(T1, T2, out_mode, mode):
+    if out_mode != 'single' and out_mode != 'keep':
+        raise ValueError("out_mode must be 'single' or 'keep'!")
+    if mode != 's' and mode != 'd':
+        raise ValueError("mode must be 's'(subtraction) or 'd'(division)!")
+    geoinfo = get_geoinfo(T1)
+    geoinfo_2 = get_geoinfo(T2)
+    if geoinfo['xsize'] != geoinfo_2['xsize'] or geoinfo['ysize'] != geoinfo_2['ysize'] or \
+       geoinfo['count'] != geoinfo_2['count']:
+        raise ValueError('The size of T1 and T2 should be equal: {} != {}.'.format(
+            [geoinfo['ysize'], geoinfo['xsize'], geoinfo['count']],
+            [geoinfo_2['ysize'], geoinfo_2['xsize'], geoinfo_2['count']]))
+    return geoinfo
+
+
+def tiled_compute(t1_path, t2_path, save_path, out_mode, mode, norm, cva, block_size, num_workers):
+    T1 = open_tif(t1_path)
+    T2 = open_tif(t2_path)
+    geoinfo = check_inputs(T1, T2, out_mode, mode)
+    del T1, T2
+    out_count = 1 if out_mode == 'single' else geoinfo['count']
+    windows = block_windows(geoinfo['xsize'], geoinfo['ysize'], block_size)
+    with Pool(num_workers, initializer=init_worker, initargs=(t1_path, t2_path)) as pool:
+        stats = None
+        if norm:
+            # 第一遍：流式统计全局的最小值、最大值及向量长度
+            d_min = np.full([out_count], np.inf)
+            d_max = np.full([out_count], -np.inf)
+            sq_sum = np.zeros([out_count])
+            tasks = [(window, out_mode, mode) for window in windows]
+            for b_min, b_max, b_sq in pool.imap_unordered(block_stats, tasks):
+                d_min = np.minimum(d_min, b_min)
+                d_max = np.maximum(d_max, b_max)
+                sq_sum += b_sq
+            stats = (d_min, d_max, np.sqrt(sq_sum) if cva else None)
+        # 第二遍：计算并写入Float32的GeoTIFF
+        dataset = create_tif(save_path, geoinfo, count=out_count)
+        tasks = [(window, out_mode, mode, stats) for window in windows]
+        for window, block in pool.imap_unordered(block_normalize, tasks):
+            write_window(dataset, block, window[0], window[1])
+        dataset.FlushCache()
+        del dataset
+    print('[Tiled] result saved in: ' + save_path)
+    return save_path
+
+
+def Tiled_CVA(t1_path, t2_path, save_path, out_mode='single', block_size=1024, num_workers=4):
+    '''
+        分块计算超大影像的CVA，不需要将整幅影像读入内存。
+        第一遍分块统计全局的最小值、最大值和向量长度，第二遍分块归一化并写入GeoTIFF，结果与CVA一致。
+        Args:
+            t1_path (str): 时刻一的影像路径
+            t2_path (str): 时刻二的影像路径，大小需要与时刻一相同
+            save_path (str): 结果保存路径 (.tif)，数据类型为Float32
+            out_mode (str, 可选): 返回图像的通道数，只能为'single'或'keep'，默认为'single'
+            block_size (int, 可选): 分块大小，默认为1024
+            num_workers (int, 可选): 计算的进程数，默认为4
+        Return：
+            save_path (str): 结果保存路径
+    '''
+    return tiled_compute(t1_path, t2_path, save_path, out_mode, 's', True, True, \
+                         block_size, num_workers)
+
+
+def Tiled_BaseCompute(t1_path, t2_path, save_path, out_mode='single', mode='s', \
+                      normalize=False, block_size=1024, num_workers=4):
+    '''
+        分块对超大影像进行做差/除运算，不需要将整幅影像读入内存。
+        Args:
+            t1_path (str): 时刻一的影像路径
+            t2_path (str): 时刻二的影像路径，大小需要与时刻一相同
+            save_path (str): 结果保存路径 (.tif)，数据类型为Float32
+            out_mode (str, 可选): 返回图像的通道数，只能为'single'或'keep'，默认为'single'
+            mode (str, 可选): 's'为做差，'d'为做除，默认为's'
+            normalize (bool, 可选): 是否按全局最小值、最大值归一化到[0, 1]，需要多读一遍影像，默认为False
+            block_size (int, 可选): 分块大小，默认为1024
+            num_workers (int, 可选): 计算的进程数，默认为4
+        Return：
+            save_path (str): 结果保存路径
+    '''
+    return tiled_compute(t1_path, t2_path, save_path, out_mode, mode, normalize, False, \
+                         block_size, num_workers)
@@ -1,3 +1,4 @@
 from .transforms import *
 from .enhance import *
+from .batch_transforms import *
 from . import functional
\ No newline at end of file
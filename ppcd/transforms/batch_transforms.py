@@ -0,0 +1,328 @@
+import math
+import numpy as np
+import cv2
+import paddle
+import paddle.nn.functional as F
+
+
+# 按每个样本的掩膜选择变换前后的结果，mask形状为[N]
+def select(mask, new, old):
+    m = paddle.cast(mask, old.dtype).reshape([-1] + [1] * (len(old.shape) - 1))
+    return new * m + old * (1 - m)
+
+
+# 每个样本是否执行，形状为[N]
+def sample_mask(n, prob):
+    return paddle.rand([n]) < prob
+
+
+# 对前band_num个波段进行操作，其余波段保持不变
+def apply_bands(img, band_num, fn):
+    if band_num >= img.shape[1]:
+        return fn(img)
+    return paddle.concat([fn(img[:, :band_num]), img[:, band_num:]], axis=1)
+
+
+# ----- batch compose -----
+class BatchCompose:
+    """
+    对DataLoader整理好的一批数据进行数据增强，所有操作均为Paddle算子，可以在GPU上执行
+    输入图像为 [N, C, H, W] 的Tensor列表，标签为 [N, 1, H, W] 的Tensor列表
+    每个样本独立抽取随机参数，几何变换在同一样本的各个时段及标签之间共享参数
+    BatchRandomColor/BatchRandomFog的参数为0-255的像素值，需要在BatchNormalize之前执行，
+    此时数据集的transforms中不能有Normalize，标准化由BatchNormalize在整批上完成；
+    BatchCompose只作用于训练的批，评估/预测数据的transforms需要加上相同均值和标准差的Normalize，
+    Train会检查eval_data
+    Args:
+        transforms (list): 批数据增强算子
+    """
+    def __init__(self, transforms):
+        if not isinstance(transforms, list):
+            raise ValueError('transforms should be list.')
+        normalized = False
+        for op in transforms:
+            if getattr(op, 'raw_pixel', False) and normalized:
+                raise ValueError('{} works on raw pixel values, it should be placed before BatchNormalize.'
+                                 .format(type(op).__name__))
+            normalized = normalized or isinstance(op, BatchNormalize)
+        self.normalized = normalized
+        self.transforms = transforms
+
+    def __call__(self, imgs, labs=None):
+        with paddle.no_grad():
+            imgs = [paddle.cast(img, 'float32') for img in imgs]
+            for op in self.transforms:
+                imgs, labs = op(imgs, labs)
+        return imgs, labs
+
+
+# ----- batch transforms -----
+class BatchNormalize:
+    """
+    对一批图像进行标准化，与Normalize一致
+        1.图像像素归一化到区间 [0.0, 1.0]
+        2.对图像进行减均值除以标准差操作
+    Args:
+        mean (list): 图像数据集的均值列表，有多少波段需要多少个元素
+        std (list): 图像数据集的标准差列表，有多少波段需要多少个元素
+        bit_num (int): 图像的位数，默认为8
+        band_num (int): 操作的波段数，默认为3
+    """
+    def __init__(self, mean, std, bit_num=8, band_num=3):
+        if bit_num not in [8, 16, 24]:
+            raise ValueError('{} is not effective bit_num, bit_num should be one of 8, 16, 24.'
+                             .format(bit_num))
+        if band_num != len(mean) or band_num != len(std):
+            raise ValueError('band_num should be equal to len of mean/std.')
+        if 0 in std:
+            raise ValueError('{}: std is invalid!'.format(self))
+        self.band_num = band_num
+        self.max_val = float(2**bit_num - 1)
+        self.mean = np.array(mean, dtype='float32').reshape([1, band_num, 1, 1])
+        self.std = np.array(std, dtype='float32').reshape([1, band_num, 1, 1])
+
+    def __call__(self, imgs, labs=None):
+        mean = paddle.to_tensor(self.mean)
+        std = paddle.to_tensor(self.std)
+        imgs = [apply_bands(img, self.band_num, lambda x: (x / self.max_val - mean) / std) \
+                for img in imgs]
+        return imgs, labs
+
+
+class BatchRandomFlip:
+    """
+    对一批图像和标注图进行翻转
+    Args:
+        prob (float): 随机翻转的概率。默认值为0.5
+        direction (str): 翻转方向，可选参数为 ['Horizontal', 'Vertical', 'Both']，默认为'Both'
+    """
+    flips_dict = {'Horizontal': [3], 'Vertical': [2], 'Both': [2, 3]}
+    def __init__(self, prob=0.5, direction='Both'):
+        if prob < 0 or prob > 1:
+            raise ValueError('prob should be between 0 and 1.')
+        assert direction in self.flips_dict, 'direction should be one of {}.'.format(self.flips_dict.keys())
+        self.prob = prob
+        self.axis = self.flips_dict[direction]
+
+    def __call__(self, imgs, labs=None):
+        mask = sample_mask(imgs[0].shape[0], self.prob)
+        imgs = [select(mask, paddle.flip(img, self.axis), img) for img in imgs]
+        if labs is not None:
+            labs = [select(mask, paddle.flip(lab, self.axis), lab) for lab in labs]
+        return imgs, labs
+
+
+class BatchRandomRotate90:
+    """
+    对一批图像和标注图随机旋转90/180/270度，旋转90/270度时需要图像的高宽相等
+    Args:
+        prob (float): 旋转的概率。默认值为0.5
+    """
+    def __init__(self, prob=0.5):
+        if prob < 0 or prob > 1:
+            raise ValueError('prob should be between 0 and 1.')
+        self.prob = prob
+
+    def __call__(self, imgs, labs=None):
+        n, _, h, w = imgs[0].shape
+        if h != w:
+            raise ValueError('BatchRandomRotate90: height and width should be equal, but they are {} and {}.'
+                             .format(h, w))
+        mask = sample_mask(n, self.prob)
+        k = paddle.randint(1, 4, [n])
+        for kk in range(1, 4):
+            kmask = paddle.logical_and(mask, k == kk)
+            if not kmask.any():
+                continue
+            imgs = [select(kmask, paddle.rot90(img, kk, axes=[2, 3]), img) for img in imgs]
+            if labs is not None:
+                labs = [select(kmask, paddle.rot90(lab, kk, axes=[2, 3]), lab) for lab in labs]
+        return imgs, labs
+
+
+class BatchRandomColor:
+    """
+    对一批图像随机进行对比度及亮度的小范围增减，同一样本的各个时段使用相同的参数
+    亮度为0-255的像素值，需要在BatchNormalize之前执行
+    Args：
+        prob (float): 改变概率。默认为0.5
+        alpha_range (list/tuple): 图像对比度调节范围，默认为 [0.8, 1.2]
+        beta_range (list/tuple): 图像亮度调节范围，默认为 [-10, 10]
+        band_num (int): 操作的波段数，默认为3
+        img_do (list): 对哪几个时段进行操作，默认为[0, 1]
+    """
+    raw_pixel = True
+    def __init__(self, prob=0.5, alpha_range=[0.8, 1.2], beta_range=[-10, 10], band_num=3, img_do=[0, 1]):
+        if prob < 0 or prob > 1:
+            raise ValueError('prob should be between 0 and 1.')
+        if len(alpha_range) != 2 or len(beta_range) != 2:
+            raise ValueError('alpha_range and beta_range should include 2 elements.')
+        if not isinstance(img_do, list):
+            raise ValueError('img_do should be list.')
+        self.prob = prob
+        self.alpha_range = list(alpha_range)
+        self.beta_range = list(beta_range)
+        self.band_num = band_num
+        self.img_do = img_do
+
+    def __call__(self, imgs, labs=None):
+        n = imgs[0].shape[0]
+        mask = sample_mask(n, self.prob)
+        alpha = paddle.uniform([n, 1, 1, 1], min=self.alpha_range[0], max=self.alpha_range[1])
+        beta = paddle.uniform([n, 1, 1, 1], min=self.beta_range[0], max=self.beta_range[1])
+        imgs = [select(mask, apply_bands(img, self.band_num, lambda x: alpha * x + beta), img) \
+                if i in self.img_do else img for i, img in enumerate(imgs)]
+        return imgs, labs
+
+
+class BatchRandomBlur:
+    """
+    对一批图像进行高斯模糊，使用逐通道卷积，边界与cv2.GaussianBlur一致 (BORDER_REFLECT_101)
+    Args：
+        prob (float): 图像模糊概率。默认为0.1
+        ksize (int): 高斯核大小，默认为3
+        band_num (int): 操作的波段数，默认为3
+        img_do (list): 对哪几个时段进行操作，默认为[0, 1]
+    """
+    def __init__(self, prob=0.1, ksize=3, band_num=3, img_do=[0, 1]):
+        if prob < 0 or prob > 1:
+            raise ValueError('prob should be between 0 and 1.')
+        if ksize % 2 != 1:
+            raise ValueError('ksize should be odd.')
+        if not isinstance(img_do, list):
+            raise ValueError('img_do should be list.')
+        self.prob = prob
+        self.ksize = ksize
+        self.band_num = band_num
+        self.img_do = img_do
+        kernel = cv2.getGaussianKernel(ksize, 0).astype('float32')
+        self.kernel = (kernel @ kernel.T)[np.newaxis, np.newaxis, :, :]
+
+    def blur(self, x):
+        c = x.shape[1]
+        pad = self.ksize // 2
+        weight = paddle.to_tensor(np.tile(self.kernel, (c, 1, 1, 1)))
+        x = F.pad(x, [pad, pad, pad, pad], mode='reflect')
+        return F.conv2d(x, weight, groups=c)
+
+    def __call__(self, imgs, labs=None):
+        mask = sample_mask(imgs[0].shape[0], self.prob)
+        if not mask.any():
+            return imgs, labs
+        imgs = [select(mask, apply_bands(img, self.band_num, self.blur), img) \
+                if i in self.img_do else img for i, img in enumerate(imgs)]
+        return imgs, labs
+
+
+class BatchRandomFog:
+    """
+    对一批图像随机加上雾效果，每个时段的雾浓度单独抽取
+    雾为0-255的像素值，需要在BatchNormalize之前执行
+    Args：
+        prob (float): 加上雾效果的概率。默认为0.5
+        fog_range (list/tuple): 雾的大小范围，范围在0-1之间，默认为 [0.03, 0.28]
+        band_num (int): 操作的波段数，默认为3
+        img_do (list): 对哪几个时段进行操作，默认为[0, 1]
+    """
+    raw_pixel = True
+    def __init__(self, prob=0.5, fog_range=[0.03, 0.28], band_num=3, img_do=[0, 1]):
+        if prob < 0 or prob > 1:
+            raise ValueError('prob should be between 0 and 1.')
+        if len(fog_range) != 2:
+            raise ValueError('fog_range should include 2 elements, but it is {}.'.format(fog_range))
+        if not isinstance(img_do, list):
+            raise ValueError('img_do should be list.')
+        self.prob = prob
+        self.fog_range = list(fog_range)
+        self.band_num = band_num
+        self.img_do = img_do
+
+    def __call__(self, imgs, labs=None):
+        n = imgs[0].shape[0]
+        mask = sample_mask(n, self.prob)
+        images = []
+        for i, img in enumerate(imgs):
+            if i in self.img_do:
+                # 与add_fog一致：a * img + 175
+                a = paddle.uniform([n, 1, 1, 1], min=self.fog_range[0], max=self.fog_range[1])
+                a = paddle.round(a * 100) / 100
+                img = select(mask, apply_bands(img, self.band_num, lambda x: a * x + 175), img)
+            images.append(img)
+        return images, labs
+
+
+class BatchRandomStrip:
+    """
+    对一批图像随机加上条带噪声，每个时段的条带位置单独抽取
+    Args：
+        prob (float): 加上条带噪声的概率。默认为0.5
+        strip_rate (float): 条带占比，默认0.05
+        direction (str): 条带方向，可选参数 ['Horizontal', 'Vertical'],，默认'Horizontal'
+        band_num (int): 操作的波段数，默认为3
+        img_do (list): 对哪几个时段进行操作，默认为[0, 1]
+    """
+    strip_list = ['Horizontal', 'Vertical']
+    def __init__(self, prob=0.5, strip_rate=0.05, direction='Horizontal', band_num=3, img_do=[0, 1]):
+        assert direction in self.strip_list, 'direction should be one of {}.'.format(self.strip_list)
+        if prob < 0 or prob > 1:
+            raise ValueError('prob should be between 0 and 1.')
+        if strip_rate < 0 or strip_rate > 1:
+            raise ValueError('strip_rate should be between 0 and 1.')
+        if not isinstance(img_do, list):
+            raise ValueError('img_do should be list.')
+        self.prob = prob
+        self.strip_rate = strip_rate
+        self.direction = direction
+        self.band_num = band_num
+        self.img_do = img_do
+
+    def __call__(self, imgs, labs=None):
+        n, _, h, w = imgs[0].shape
+        num = h if self.direction == 'Horizontal' else w
+        strip_num = math.ceil(self.strip_rate * num)
+        shape = [n, 1, num, 1] if self.direction == 'Horizontal' else [n, 1, 1, num]
+        mask = sample_mask(n, self.prob)
+        images = []
+        for i, img in enumerate(imgs):
+            if i in self.img_do:
+                # 随机数排序后取前strip_num个位置，每个样本的条带数与random_strip相同
+                rank = paddle.argsort(paddle.argsort(paddle.rand([n, num]), axis=1), axis=1)
+                keep = paddle.cast(rank >= strip_num, img.dtype).reshape(shape)
+                img = select(mask, apply_bands(img, self.band_num, lambda x: x * keep), img)
+            images.append(img)
+        return images, labs
+
+
+class BatchRandomRemoveBand:
+    """
+    对一批图像随机置零某个波段，同一样本的各个时段置零相同的波段
+    Args：
+        prob (float): 执行此操作的概率。默认为0.1
+        kill_bands (list): 必须置零的波段列表，默认为None
+        keep_bands (list): 不能置零的波段列表，默认为None
+    """
+    def __init__(self, prob=0.1, kill_bands=None, keep_bands=None):
+        if prob < 0 or prob > 1:
+            raise ValueError('prob should be between 0 and 1.')
+        if not(isinstance(kill_bands, list)) and kill_bands != None:
+            raise ValueError('kill_bands must be list or None.')
+        if not(isinstance(keep_bands, list)) and keep_bands != None:
+            raise ValueError('keep_bands must be list or None.')
+        self.prob = prob
+        self.kill_bands = [] if kill_bands == None else list(kill_bands)
+        self.keep_bands = [] if keep_bands == None else list(keep_bands)
+
+    def __call__(self, imgs, labs=None):
+        n, c = imgs[0].shape[:2]
+        rand_list = [i for i in range(c) if i not in self.kill_bands and i not in self.keep_bands]
+        mask = sample_mask(n, self.prob)
+        kill = np.zeros([c], dtype='float32')
+        kill[self.kill_bands] = 1
+        kill = paddle.to_tensor(kill).reshape([1, c])
+        if len(rand_list) > 0:
+            rnd = paddle.randint(0, len(rand_list), [n])
+            rnd = paddle.gather(paddle.to_tensor(rand_list, dtype='int64'), rnd)
+            kill = paddle.clip(kill + F.one_hot(rnd, c), max=1)
+        keep = (1 - kill).reshape([-1, c, 1, 1])
+        imgs = [select(mask, img * paddle.cast(keep, img.dtype), img) for img in imgs]
+        return imgs, labs
@@ -8,7 +8,7 @@ from PIL import Image
 from scipy import io
 
 
-# 根据图像类型读取图像
+# 根据图像类型读取图像，图像保持原来的数据类型（整型交给Normalize查表），标签为float32
 def read_img(img_path, data_format, is_lab, classes_num=2):
     img_format = imghdr.what(img_path)
     _, ext = os.path.splitext(img_path)
@@ -23,15 +23,15 @@ def read_img(img_path, data_format, is_lab, classes_num=2):
         if img_format == 'tiff' or ext == '.img':
             if ipt_gdal == True:
                 img_data = gdal.Open(img_path).ReadAsArray()
-                return img_data.transpose((1, 2, 0)).astype('float32')  # 多波段图像默认是CHW
+                img_data = img_data.transpose((1, 2, 0))  # 多波段图像默认是CHW
+                return img_data.astype('float32') if is_lab else img_data
             else:
                 raise Exception('Unable to open TIF/IMG image without GDAL!')
         elif ext == '.npy' or ext == '.npz':
             npy_data = np.load(img_path)
-            if data_format == "HWC":
-                return npy_data.astype('float32')
-            else:
-                return npy_data.transpose((1, 2, 0)).astype('float32')
+            if data_format != "HWC":
+                npy_data = npy_data.transpose((1, 2, 0))
+            return npy_data.astype('float32') if is_lab else npy_data
         elif img_format == 'jpeg' or img_format == 'png' or img_format == 'bmp':
             if is_lab:
                 jp_data = np.asarray(Image.open(img_path))
@@ -39,7 +39,7 @@ def read_img(img_path, data_format, is_lab, classes_num=2):
                     jp_data = jp_data.clip(max=1)
             else:
                 jp_data = cv2.cvtColor(cv2.imread(img_path), cv2.COLOR_BGR2RGB)
-            return jp_data.astype('float32')
+            return jp_data.astype('float32') if is_lab else jp_data
         elif ext == '.mat':
             arr = None
             mat = io.loadmat(img_path)
@@ -51,7 +51,7 @@ def read_img(img_path, data_format, is_lab, classes_num=2):
                 arr = arr.transpose((0, 1))
             else:
                 arr = arr.transpose((0, 1, 2))
-            return arr.astype('float32')
+            return arr.astype('float32') if is_lab else arr
         else:
             raise Exception('Not support {} image format!'.format(ext))
 
@@ -66,6 +66,22 @@ def normalize(img, min_value, max_value, mean, std, band_num):
     return cimg
 
 
+# 整型图像的标准化查找表，每个波段一张表，形状为 [band_num, 256/65536]
+def normalize_lut(dtype, min_value, max_value, mean, std, band_num):
+    vals = np.arange(np.iinfo(dtype).max + 1, dtype=np.float64)
+    luts = [((vals - min_value[i]) / (max_value[i] - min_value[i]) - mean[i]) / std[i] \
+            for i in range(band_num)]
+    return np.stack(luts).astype(np.float32)
+
+
+# 通过查找表标准化，所有波段一次索引得到连续的float32输出
+def normalize_by_lut(img, luts, band_num):
+    cimg = luts[np.arange(band_num), img[:, :, :band_num]]
+    if img.shape[-1] > band_num:
+        cimg = np.concatenate([cimg, img[:, :, band_num:].astype(np.float32)], axis=-1)
+    return cimg
+
+
 # 图像翻转
 def mode_flip(img, mode):
     if len(img.shape) == 3:
@@ -124,6 +140,43 @@ def narrow_img(img, x_rate, y_rate, ig_pix=None):
     return img
 
 
+# 翻转的仿射矩阵 (3x3)
+def flip_matrix(h, w, mode):
+    mat = np.eye(3)
+    if mode == 'Horizontal' or mode == 'Both':
+        mat = np.array([[-1, 0, w - 1], [0, 1, 0], [0, 0, 1]], dtype='float64') @ mat
+    if mode == 'Vertical' or mode == 'Both':
+        mat = np.array([[1, 0, 0], [0, -1, h - 1], [0, 0, 1]], dtype='float64') @ mat
+    return mat
+
+
+# 旋转的仿射矩阵 (3x3)，与rotate_img一致
+def rotate_matrix(h, w, ang):
+    mat = cv2.getRotationMatrix2D((w * 0.5, h * 0.5), ang, 1)
+    return np.vstack([mat, [0, 0, 1]])
+
+
+# 缩放加平移的仿射矩阵 (3x3)，按像素中心对齐，与cv2.resize的LINEAR/CUBIC等插值一致
+# cv2.resize的NEAREST按floor(dst / scale)取值，没有半像素偏移，与此矩阵的结果在部分行列上相差一个像素
+def scale_matrix(sx, sy, tx=0, ty=0):
+    return np.array([[sx, 0, 0.5 * sx - 0.5 + tx],
+                     [0, sy, 0.5 * sy - 0.5 + ty],
+                     [0, 0, 1]], dtype='float64')
+
+
+# 按仿射矩阵对图像进行一次重采样
+def warp_img(img, mat, size, interp=cv2.INTER_NEAREST, border_value=None):
+    if img.dtype not in [np.uint8, np.uint16, np.int16, np.float32, np.float64]:
+        img = img.astype('float32')
+    border_value = [border_value] * 4 if border_value is not None else 0
+    dst = cv2.warpAffine(img, mat[:2], tuple(size), flags=interp, \
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=border_value)
+    # 单通道时warpAffine会去掉通道维
+    if len(img.shape) == 3 and len(dst.shape) == 2:
+        dst = dst[:, :, np.newaxis]
+    return dst
+
+
 # 随机条带
 def random_strip(img, strip_num, mode, band_num):
     h, w = img.shape[:2]
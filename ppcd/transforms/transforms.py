@@ -1,12 +1,31 @@
 import numpy as np
 import cv2
+import time
 import random
 import math
+import tracemalloc
 from functools import reduce
+from prettytable import PrettyTable
 from ppcd.transforms import functional as func
+from ppcd.utils.tracer import trace_span
 
 
 # ----- compose -----
+def op_name(op):
+    return getattr(op, 'name', type(op).__name__)
+
+
+# 整型图像转为float32，其余保持不变
+def to_float(imgs):
+    return [img.astype('float32') if np.issubdtype(img.dtype, np.integer) else img for img in imgs]
+
+
+# 按概率决定算子是否执行，结果记录在op.fired中供Compose统计命中率
+def roll(op):
+    op.fired = random.random() < op.prob
+    return op.fired
+
+
 class Compose:
     """ 
     根据数据增强算子对输入数据进行操作
@@ -15,13 +34,105 @@ class Compose:
         transforms (list/None): 数据增强算子，默认为None
         data_format ("HWC"/"CHW"): 如果数据是npy/npz格式，数据形状如何，默认为"HWC"
         classes_num (int): 标签有多少类，默认为2（单一的变化检测）
-    """
-    def __init__(self, transforms=None, data_format="HWC", classes_num=2):
+        profile (bool): 是否统计每个算子的调用次数、命中率及耗时，通过summary查看，默认为False
+        profile_memory (bool): profile时是否同时用tracemalloc统计内存分配，只在每次算子调用期间开启，
+                               开启后耗时包含tracemalloc的开销，默认为False
+        fuse_geometric (bool): 是否将连续的几何变换（Resize/RandomFlip/RandomRotate/RandomEnlarge/RandomNarrow）
+                               合并为一次仿射变换，每张图像只重采样一次，默认为False
+        fuse_interp (str): 合并后图像的插值方式，标签始终为'NEAREST'，默认为'NEAREST'
+    """
+    def __init__(self, transforms=None, data_format="HWC", classes_num=2, profile=False, \
+                 profile_memory=False, fuse_geometric=False, fuse_interp='NEAREST'):
         if data_format != "HWC" and data_format != "CHW":
             raise ValueError('The data_format must be "HWC" or "CHW"!')
         self.transforms = transforms
         self.data_format = data_format
         self.classes_num = classes_num
+        self.profile = profile
+        self.profile_memory = profile_memory
+        self.pipeline = transforms
+        if fuse_geometric and transforms is not None:
+            self.pipeline = self._fuse(transforms, fuse_interp)
+        self.reset_profile()
+
+    @staticmethod
+    def _fuse(transforms, interp):
+        # 连续两个及以上的几何变换合并为一个FusedGeometric
+        # 标签的填充值(ig_pix)不同的算子不合并，否则合并后只能使用一个填充值
+        pipeline = []
+        group = []
+        for op in list(transforms) + [None]:
+            if op is not None and hasattr(op, 'get_matrix'):
+                ig_pixs = set(g.ig_pix for g in group if hasattr(g, 'ig_pix'))
+                if not hasattr(op, 'ig_pix') or len(ig_pixs) == 0 or op.ig_pix in ig_pixs:
+                    group.append(op)
+                    continue
+            if len(group) > 1:
+                pipeline.append(FusedGeometric(group, interp))
+            else:
+                pipeline.extend(group)
+            group = []
+            if op is not None and hasattr(op, 'get_matrix'):
+                group.append(op)  # 填充值不同，开始新的一组
+            elif op is not None:
+                pipeline.append(op)
+        return pipeline
+
+    def reset_profile(self):
+        n = len(self.pipeline) if self.pipeline is not None else 0
+        self.op_stats = [{'calls': 0, 'hits': 0, 'times': [], 'bytes': 0} for _ in range(n)]
+
+    def _profile_op(self, idx, op, timgs, tlabs):
+        # 概率算子由roll记录是否执行（fired），其余算子每次都执行
+        tracing = False
+        if self.profile_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            tracing = True
+        try:
+            if self.profile_memory:
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+                mem_start = tracemalloc.get_traced_memory()[0]
+            op.fired = True
+            start = time.perf_counter()
+            out_imgs, out_labs = op(timgs, tlabs)
+            use_time = time.perf_counter() - start
+            if self.profile_memory:
+                mem_current, mem_peak = tracemalloc.get_traced_memory()
+                alloc = max(mem_peak, mem_current) - mem_start
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        stats = self.op_stats[idx]
+        stats['calls'] += 1
+        stats['times'].append(use_time)
+        if self.profile_memory:
+            stats['bytes'] += max(alloc, 0)
+        if op.fired:
+            stats['hits'] += 1
+        return out_imgs, out_labs
+
+    def summary(self):
+        '''
+            打印并返回每个算子的统计表
+        '''
+        table = PrettyTable(['op', 'calls', 'hit_rate', 'total(ms)', 'mean(ms)', 'p95(ms)', 'alloc/call(KB)'])
+        if self.pipeline is not None:
+            for op, stats in zip(self.pipeline, self.op_stats):
+                calls = stats['calls']
+                if calls == 0:
+                    table.add_row([op_name(op), 0, '-', '-', '-', '-', '-'])
+                    continue
+                times = np.array(stats['times']) * 1000
+                table.add_row([
+                    op_name(op), calls,
+                    '{:.2%}'.format(stats['hits'] / calls),
+                    '{:.2f}'.format(np.sum(times)),
+                    '{:.3f}'.format(np.mean(times)),
+                    '{:.3f}'.format(np.percentile(times, 95)),
+                    '{:.1f}'.format(stats['bytes'] / calls / 1024) if self.profile_memory else '-'])
+        print(table)
+        return table
 
     def __call__(self, imgs, labs=None):
         """
@@ -32,24 +143,32 @@ class Compose:
         """
         timgs = []
         tlabs = []
-        for i in range(len(imgs)):
-            if isinstance(imgs[i], str):
-                timgs.append(func.read_img(imgs[i], self.data_format, is_lab=False))
-            else:
-                timgs.append(imgs[i])
-        if labs is not None:
-            for i in range(len(labs)):
-                if isinstance(labs[i], str):
-                    tlabs.append(func.read_img(labs[i], self.data_format, \
-                                               is_lab=True, classes_num=self.classes_num))
+        with trace_span('read_img', 'data'):
+            for i in range(len(imgs)):
+                if isinstance(imgs[i], str):
+                    timgs.append(func.read_img(imgs[i], self.data_format, is_lab=False))
                 else:
-                    tlabs.append(labs[i])
-        else:
-            tlabs = None
-        # 数据增强
-        if self.transforms is not None:
-            for op in self.transforms:
-                timgs, tlabs = op(timgs, tlabs)
+                    timgs.append(imgs[i])
+            if labs is not None:
+                for i in range(len(labs)):
+                    if isinstance(labs[i], str):
+                        tlabs.append(func.read_img(labs[i], self.data_format, \
+                                                   is_lab=True, classes_num=self.classes_num))
+                    else:
+                        tlabs.append(labs[i])
+            else:
+                tlabs = None
+        # 数据增强，整型图像只交给Normalize（查表），其余算子前先转为float32
+        if self.pipeline is not None:
+            for idx, op in enumerate(self.pipeline):
+                if not isinstance(op, Normalize):
+                    timgs = to_float(timgs)
+                with trace_span(op_name(op), 'transform'):
+                    if self.profile:
+                        timgs, tlabs = self._profile_op(idx, op, timgs, tlabs)
+                    else:
+                        timgs, tlabs = op(timgs, tlabs)
+        timgs = to_float(timgs)
         if tlabs is None:
             return timgs
         else:
@@ -57,6 +176,43 @@ class Compose:
             return timgs, tlabst
 
 
+class FusedGeometric:
+    """
+    将多个几何变换的仿射矩阵相乘，对每张图像和标注图只进行一次warpAffine
+    各个算子的随机数抽取顺序及输出大小与逐个执行时相同，唯一已知的差异是缩放时的取样位置（见func.scale_matrix）
+    Args:
+        transforms (list): 几何变换算子，需要实现get_matrix(h, w)
+        interp (str): 图像的插值方式，标签始终为'NEAREST'，默认为'NEAREST'
+    """
+    def __init__(self, transforms, interp='NEAREST'):
+        assert interp in Resize.interp_dict, \
+            'interp should be one of {}.'.format(Resize.interp_dict.keys())
+        self.transforms = transforms
+        self.interp = interp
+        self.name = 'FusedGeometric(' + '+'.join(type(op).__name__ for op in transforms) + ')'
+
+    def __call__(self, image, label=None):
+        h, w = image[0].shape[:2]
+        mat = np.eye(3)
+        applied = False
+        ig_pix = None
+        for op in self.transforms:
+            res = op.get_matrix(h, w)
+            if res is None:  # 未命中的概率算子
+                continue
+            op_mat, (w, h) = res
+            mat = op_mat @ mat
+            applied = True
+            if ig_pix is None:
+                ig_pix = getattr(op, 'ig_pix', None)
+        if not applied:
+            return image, label
+        images = [func.warp_img(img, mat, (w, h), Resize.interp_dict[self.interp]) for img in image]
+        if label is not None:
+            label = [func.warp_img(lab, mat, (w, h), cv2.INTER_NEAREST, ig_pix) for lab in label]
+        return images, label
+
+
 # ----- transforms -----
 class Resize:
     """
@@ -102,6 +258,13 @@ class Resize:
             label = [cv2.resize(lab, size, interpolation=self.interp_dict['NEAREST']) \
                      for lab in label]
         return image, label
+
+    def get_matrix(self, h, w):
+        if isinstance(self.target_size, int):
+            size = (self.target_size, self.target_size)
+        else:
+            size = tuple(self.target_size)
+        return func.scale_matrix(size[0] / w, size[1] / h), size
             
 
 class Normalize:
@@ -130,16 +293,29 @@ class Normalize:
         self.band_num = band_num
         self.min_val = [0] * band_num
         self.max_val = [2**bit_num - 1] * band_num
+        self.luts = {}  # 按dtype缓存的查找表
 
     def __call__(self, image, label=None):
         mean = np.array(self.mean)[np.newaxis, np.newaxis, :]
         std = np.array(self.std)[np.newaxis, np.newaxis, :]
         images = []
         for i in range(len(image)):
-            images.append(func.normalize(
-                image[i], self.min_val, self.max_val, mean, std, self.band_num))
+            # uint8/uint16的图像使用查找表，一次索引完成标准化
+            if image[i].dtype in [np.uint8, np.uint16]:
+                images.append(func.normalize_by_lut(
+                    image[i], self.get_lut(image[i].dtype), self.band_num))
+            else:
+                images.append(func.normalize(
+                    image[i], self.min_val, self.max_val, mean, std, self.band_num))
         return images, label
 
+    def get_lut(self, dtype):
+        key = np.dtype(dtype).str
+        if key not in self.luts:
+            self.luts[key] = func.normalize_lut(
+                dtype, self.min_val, self.max_val, self.mean, self.std, self.band_num)
+        return self.luts[key]
+
 
 class RandomFlip:
     """
@@ -157,7 +333,7 @@ class RandomFlip:
         self.direction = direction
 
     def __call__(self, image, label=None):
-        if random.random() < self.prob:
+        if roll(self):
             images = []
             for i in range(len(image)):
                 images.append(func.mode_flip(image[i], self.direction))
@@ -167,6 +343,11 @@ class RandomFlip:
         else:
             return image, label
 
+    def get_matrix(self, h, w):
+        if roll(self):
+            return func.flip_matrix(h, w, self.direction), (w, h)
+        return None
+
 
 class RandomRotate:
     """
@@ -183,7 +364,7 @@ class RandomRotate:
 
     def __call__(self, image, label=None):
         ang = random.randint(1, 89)
-        if random.random() < self.prob:
+        if roll(self):
             images = []
             for i in range(len(image)):
                 images.append(func.rotate_img(image[i], ang))
@@ -193,6 +374,12 @@ class RandomRotate:
         else:
             return image, label
 
+    def get_matrix(self, h, w):
+        ang = random.randint(1, 89)
+        if roll(self):
+            return func.rotate_matrix(h, w, ang), (w, h)
+        return None
+
 
 class RandomEnlarge:
     """
@@ -218,7 +405,7 @@ class RandomEnlarge:
         w_clip = math.floor(self.min_clip_rate[1] * w)
         x = random.randint(0, (w - w_clip))
         y = random.randint(0, (h - h_clip))
-        if random.random() < self.prob:
+        if roll(self):
             images = []
             for i in range(len(image)):
                 images.append(func.enlarge_img(image[i], x, y, h_clip, w_clip))
@@ -228,6 +415,18 @@ class RandomEnlarge:
         else:
             return image, label
 
+    def get_matrix(self, h, w):
+        h_clip = math.floor(self.min_clip_rate[0] * h)
+        w_clip = math.floor(self.min_clip_rate[1] * w)
+        x = random.randint(0, (w - w_clip))
+        y = random.randint(0, (h - h_clip))
+        if roll(self):
+            # 与enlarge_img一致，输出大小为cv2.resize的dsize (h, w)
+            sx = h / w_clip
+            sy = w / h_clip
+            return func.scale_matrix(sx, sy, -x * sx, -y * sy), (h, w)
+        return None
+
 
 
 class RandomNarrow:
@@ -253,7 +452,7 @@ class RandomNarrow:
     def __call__(self, image, label=None):
         x_rate = random.uniform(self.min_size_rate[0], 1)
         y_rate = random.uniform(self.min_size_rate[1], 1)
-        if random.random() < self.prob:
+        if roll(self):
             images = []
             for i in range(len(image)):
                 images.append(func.narrow_img(image[i], x_rate, y_rate))
@@ -263,6 +462,17 @@ class RandomNarrow:
         else:
             return image, label
 
+    def get_matrix(self, h, w):
+        x_rate = random.uniform(self.min_size_rate[0], 1)
+        y_rate = random.uniform(self.min_size_rate[1], 1)
+        if roll(self):
+            # 与narrow_img一致：cv2.resize按fx/fy缩放，输出为round(w * x_rate)，再在两侧各填充w_pad
+            w_pad = math.floor(w * (1 - x_rate) / 2)
+            h_pad = math.floor(h * (1 - y_rate) / 2)
+            size = (round(w * x_rate) + 2 * w_pad, round(h * y_rate) + 2 * h_pad)
+            return func.scale_matrix(x_rate, y_rate, w_pad, h_pad), size
+        return None
+
 
 class RandomBlur:
     """
@@ -284,7 +494,7 @@ class RandomBlur:
         self.img_do = img_do
 
     def __call__(self, image, label=None):
-        if random.random() < self.prob:
+        if roll(self):
             for i in range(len(image)):
                 if i in self.img_do:
                     image[i][:, :, :self.band_num] = cv2.GaussianBlur(
@@ -321,7 +531,7 @@ class RandomSharpening:
         self.img_do = img_do
 
     def __call__(self, image, label=None):
-        if random.random() < self.prob:
+        if roll(self):
             for i in range(len(image)):
                 if i in self.img_do:
                     image[i][:, :, :self.band_num] += (
@@ -363,7 +573,7 @@ class RandomColor:
         self.img_do = img_do
 
     def __call__(self, image, label=None):
-        if random.random() < self.prob:
+        if roll(self):
             alpha = random.uniform(self.alpha_range[0], self.alpha_range[1])
             beta = random.uniform(self.beta_range[0], self.beta_range[1])
             for i in range(len(image)):
@@ -401,7 +611,7 @@ class RandomStrip:
 
     def __call__(self, image, label=None):
         h, w = image[0].shape[:2]
-        if random.random() < self.prob:
+        if roll(self):
             strip_num = self.strip_rate * (h if self.direction == 'Horizontal' else w)
             images = []
             for i in range(len(image)):
@@ -438,7 +648,7 @@ class RandomFog:
         self.img_do = img_do
 
     def __call__(self, image, label=None):
-        if random.random() < self.prob:
+        if roll(self):
             images = []
             for i in range(len(image)):
                 if i in self.img_do:
@@ -466,7 +676,7 @@ class RandomSplicing:
         self.band_num = band_num
         
     def __call__(self, image, label=None):
-        if random.random() < self.prob:
+        if roll(self):
             images = []
             for i in range(len(image)):
                 images.append(func.random_splicing(image[i], self.direction, self.band_num))
@@ -495,7 +705,7 @@ class RandomRemoveBand:
         self.keep_bands = [] if keep_bands == None else list(keep_bands)
 
     def __call__(self, image, label=None):
-        if random.random() < self.prob:
+        if roll(self):
             rand_list = []
             rm_list = []
             c = image[0].shape[-1]
@@ -1,3 +1,9 @@
-from .timer import TimeAverager, calculate_eta
+from .timer import TimeAverager, StageTimer, calculate_eta
 from .vis import show_result_RGB
-from .loss_compute import loss_computation, check_logits_losses
\ No newline at end of file
+from .loss_compute import loss_computation, check_logits_losses
+from .amp import auto_cast, grad_scaler, check_amp
+from .checkpoint import CheckpointSaver
+from .logger import LossAverager, AsyncLogWriter
+from .tracer import enable_trace, disable_trace, export_trace, trace_span, trace_layers
+from .hashing import hash_arrays, hash_file, hash_files, hash_model, hash_config
+from .tile_store import TileStore, LogitsCache
\ No newline at end of file
@@ -0,0 +1,39 @@
+import paddle
+
+
+# 数值敏感的算子（BCELoss/DiceLoss中的交叉熵、softmax、求和/均值及除法等），混合精度下仍保持FP32计算
+AMP_BLACK_LIST = [
+    'sigmoid_cross_entropy_with_logits', 'softmax', 'log', 'exp', 'pow',
+    'reduce_sum', 'reduce_mean', 'sum', 'mean', 'elementwise_div', 'divide'
+]
+
+
+def check_amp(amp):
+    if amp not in [None, 'fp16', 'bf16']:
+        raise ValueError("amp must be None, 'fp16' or 'bf16', but it is {}.".format(amp))
+
+
+def auto_cast(amp=None):
+    '''
+        混合精度计算的上下文，amp为None时不开启
+        Args:
+            amp (str/None): 'fp16'（GPU等支持半精度的设备）或 'bf16'（支持AMX/AVX512-BF16的CPU），默认为None
+    '''
+    check_amp(amp)
+    if amp is None:
+        return paddle.amp.auto_cast(enable=False)
+    return paddle.amp.auto_cast(
+        enable=True,
+        custom_black_list=AMP_BLACK_LIST,
+        level='O1',
+        dtype=('float16' if amp == 'fp16' else 'bfloat16'))
+
+
+def grad_scaler(amp=None, init_loss_scaling=2.**15):
+    '''
+        fp16的数值范围较小需要进行损失缩放，bf16与fp32的指数位相同不需要缩放
+    '''
+    check_amp(amp)
+    if amp == 'fp16':
+        return paddle.amp.GradScaler(init_loss_scaling=init_loss_scaling)
+    return None
@@ -0,0 +1,125 @@
+import os
+import time
+import queue
+import threading
+import paddle
+
+
+# 将state_dict中的Tensor拷贝到内存中（numpy），之后训练继续更新参数也不会影响保存的内容
+def snapshot(state):
+    if isinstance(state, paddle.Tensor):
+        return state.numpy()
+    elif isinstance(state, dict):
+        return {k: snapshot(v) for k, v in state.items()}
+    elif isinstance(state, (list, tuple)):
+        return type(state)(snapshot(v) for v in state)
+    else:
+        return state
+
+
+class CheckpointSaver(object):
+    """
+    非阻塞的模型保存，state_dict拷贝到内存后由后台线程写入磁盘，写入临时文件后再重命名，避免留下不完整的文件
+    Args:
+        save_dir (str): 保存的文件夹
+        keep_last (int/None): 保留最近的几个检查点，为None时全部保留，默认为None
+        keep_best (bool): 是否额外保留指标最好的检查点，默认为True
+        save_minutes (float/None): 按时间保存的间隔（分钟），为None时只按epoch保存，默认为None
+        higher_better (bool): 指标是否越大越好，默认为True
+        max_pending (int): 最多等待写入的检查点数，队列满时save阻塞，避免写入变慢时内存不断增长，默认为2
+    后台写入出错时（如磁盘已满），下一次save或close会抛出该错误
+    """
+    def __init__(self, save_dir, keep_last=None, keep_best=True, save_minutes=None, higher_better=True, \
+                 max_pending=2):
+        if keep_last is not None and keep_last < 1:
+            raise ValueError('keep_last should be greater than 0, but it is {}.'.format(keep_last))
+        self.save_dir = save_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.save_minutes = save_minutes
+        self.higher_better = higher_better
+        self.saved = []  # 已经写入的检查点名称
+        self.best_name = None
+        self.best_metric = None
+        self.last_time = time.time()
+        self.error = None  # 后台线程中的第一个错误
+        self.tasks = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def time_to_save(self):
+        if self.save_minutes is None:
+            return False
+        return (time.time() - self.last_time) >= self.save_minutes * 60
+
+    def save(self, name, model_state, opt_state=None, metric=None, callback=None):
+        '''
+            name为检查点名称（如epoch_1），callback(params_path)在写入完成后于后台线程中调用
+        '''
+        self._check_error()
+        self.last_time = time.time()
+        self.tasks.put((name, snapshot(model_state), snapshot(opt_state), metric, callback))
+
+    def close(self):
+        # 等待所有检查点写入完成
+        self.tasks.put(None)
+        self.thread.join()
+        self._check_error()
+
+    def _check_error(self):
+        if self.error is not None:
+            raise RuntimeError('CheckpointSaver failed in the background: {}'.format(self.error)) from self.error
+
+    def _atomic_save(self, state, path):
+        tmp_path = os.path.join(os.path.dirname(path), '.tmp_' + os.path.basename(path))
+        paddle.save(state, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _worker(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            # 出错后继续取出任务，保证save/close不会阻塞，错误由save/close抛出
+            if self.error is not None:
+                continue
+            try:
+                self._save_task(*task)
+            except Exception as e:
+                self.error = e
+
+    def _save_task(self, name, model_state, opt_state, metric, callback):
+        params_path = os.path.join(self.save_dir, name + '.pdparams')
+        self._atomic_save(model_state, params_path)
+        if opt_state is not None:
+            self._atomic_save(opt_state, os.path.join(self.save_dir, name + '.pdopt'))
+        self.saved.append(name)
+        if metric is not None:
+            if self.best_metric is None or \
+               (metric > self.best_metric if self.higher_better else metric < self.best_metric):
+                old_best = self.best_name
+                self.best_metric = metric
+                self.best_name = name
+                # 之前最好的检查点如果已经不在最近的范围内则删除
+                if self.keep_last is not None and old_best is not None and \
+                   old_best not in self.saved:
+                    self._remove(old_best)
+        self._remove_old()
+        if callback is not None:
+            callback(params_path)
+
+    def _remove_old(self):
+        if self.keep_last is None:
+            return
+        while len(self.saved) > self.keep_last:
+            name = self.saved.pop(0)
+            if self.keep_best and name == self.best_name:
+                # 最好的检查点不删除，也不计入最近的数量
+                continue
+            self._remove(name)
+
+    def _remove(self, name):
+        for ext in ['.pdparams', '.pdopt']:
+            path = os.path.join(self.save_dir, name + ext)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import numpy as np
+
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_arrays(arrays):
+    '''
+        计算一组数组内容（包括形状和数据类型）的哈希
+    '''
+    hasher = new_hasher()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        hasher.update(str((arr.shape, arr.dtype.str)).encode())
+        hasher.update(arr.tobytes())
+    return hasher.hexdigest()
+
+
+def hash_file(path, hasher=None, chunk_size=1 << 20):
+    '''
+        分块读取文件计算哈希
+    '''
+    hasher = new_hasher() if hasher is None else hasher
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_files(paths):
+    '''
+        多个文件（如多期影像）合并的哈希
+    '''
+    hasher = new_hasher()
+    for path in paths:
+        hash_file(path, hasher)
+    return hasher.hexdigest()
+
+
+def hash_model(model, params_path=None):
+    '''
+        计算模型的哈希：有params_path时使用参数文件，静态图预测器使用模型文件，否则使用state_dict
+    '''
+    hasher = new_hasher()
+    hasher.update(type(model).__name__.encode())
+    if params_path is not None:
+        return hash_file(params_path, hasher)
+    model_path = getattr(model, 'model_path', None)  # Predictor
+    if model_path is not None:
+        hash_file(model_path + '.pdmodel', hasher)
+        return hash_file(model_path + '.pdiparams', hasher)
+    for name, param in sorted(model.state_dict().items()):
+        hasher.update(name.encode())
+        hasher.update(np.ascontiguousarray(param.numpy()).tobytes())
+    return hasher.hexdigest()
+
+
+# 运行时的状态（命中标记、查找表缓存、统计量），不属于配置
+RUNTIME_ATTRS = ('fired', 'luts', 'op_stats')
+
+
+def config_of(obj):
+    '''
+        对象的配置（类名及公开属性），可以转为json；网络使用hash_model，数组使用hash_arrays
+    '''
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [config_of(v) for v in obj]
+    if isinstance(obj, dict):
+        return {str(k): config_of(v) for k, v in obj.items()}
+    if isinstance(obj, np.ndarray):
+        return hash_arrays([obj])
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, 'state_dict') or hasattr(obj, 'model_path'):  # nn.Layer/Predictor
+        return hash_model(obj)
+    if hasattr(obj, '__dict__'):
+        config = {'type': type(obj).__name__}
+        for k, v in vars(obj).items():
+            if not k.startswith('_') and k not in RUNTIME_ATTRS:
+                config[k] = config_of(v)
+        return config
+    return repr(obj)
+
+
+def hash_config(obj):
+    '''
+        计算对象配置的哈希，如数据增强算子、门控
+    '''
+    hasher = new_hasher()
+    hasher.update(json.dumps(config_of(obj), sort_keys=True).encode())
+    return hasher.hexdigest()
@@ -0,0 +1,64 @@
+import queue
+import threading
+
+
+class LossAverager(object):
+    """
+    在设备上累加损失，只在需要输出时拷贝一次到内存，避免每一步都进行同步
+    """
+    def __init__(self):
+        self.total = None
+        self.cnt = 0
+        self.reset()
+
+    def reset(self):
+        self.total = None
+        self.cnt = 0
+
+    def record(self, loss):
+        loss = loss.detach()
+        self.total = loss if self.total is None else (self.total + loss)
+        self.cnt += 1
+
+    def get_average(self):
+        if self.cnt == 0:
+            return 0.
+        return float(self.total.numpy().reshape([-1])[0]) / self.cnt
+
+
+class AsyncLogWriter(object):
+    """
+    在后台线程中写入VisualDL，训练循环中的add_scalar只是放入队列
+    Args:
+        writer (LogWriter): VisualDL的LogWriter或其他有add_scalar的对象
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.tasks = queue.Queue()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        self.writer.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        self.writer.__exit__(*args)
+
+    def add_scalar(self, tag, step, value):
+        self.tasks.put((tag, step, value))
+
+    def close(self):
+        # 等待队列中的数据全部写入
+        if self.thread.is_alive():
+            self.tasks.put(None)
+            self.thread.join()
+
+    def _worker(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            tag, step, value = task
+            self.writer.add_scalar(tag=tag, step=step, value=value)
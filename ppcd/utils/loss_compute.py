@@ -1,4 +1,4 @@
-# import paddle
+import paddle
 
 
 def check_logits_losses(logits_list, losses):
@@ -31,6 +31,9 @@ def loss_computation(logits_list, labels, losses, epoch=None, batch=None):
                 .format(len(logits_list), len(labels)))
     for i in range(len(logits_list)):
         logits = logits_list[i]
+        # 混合精度下的输出在损失计算前转回FP32
+        if logits.dtype in [paddle.float16, paddle.bfloat16]:
+            logits = logits.astype('float32')
         coef_i = losses['ceof'][i]
         loss_i = losses['type'][i]
         label_i = labels[i] if lab_m else labels[0]  # 多标签损失
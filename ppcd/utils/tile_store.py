@@ -0,0 +1,64 @@
+import os
+import glob
+import numpy as np
+
+
+class TileStore(object):
+    """
+    按块保存的预测结果，路径为 root/model_key/date_key/index_inputhash.npz
+    输入块的哈希不变时直接读取保存的结果，用于增量预测
+    Args:
+        root (str): 保存的文件夹
+        model_key (str): 模型（及阈值）的哈希
+        date_key (str): 两期影像的标识，如'20210101_20210601'
+    """
+    def __init__(self, root, model_key, date_key):
+        self.tile_dir = os.path.join(root, model_key, date_key)
+        if os.path.exists(self.tile_dir) == False:
+            os.makedirs(self.tile_dir)
+
+    def _path(self, index, input_key):
+        return os.path.join(self.tile_dir, '{}_{}.npz'.format(index, input_key))
+
+    def get(self, index, input_key):
+        path = self._path(index, input_key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data['pred']
+
+    def put(self, index, input_key, pred):
+        # 删除该块输入变化前的结果，写入临时文件后再重命名
+        for old_path in glob.glob(os.path.join(self.tile_dir, '{}_*.npz'.format(index))):
+            os.remove(old_path)
+        path = self._path(index, input_key)
+        tmp_path = os.path.join(self.tile_dir, '.tmp_{}_{}.npz'.format(index, input_key))
+        np.savez_compressed(tmp_path, pred=pred)
+        os.replace(tmp_path, path)
+
+
+class LogitsCache(object):
+    """
+    按内容寻址的网络输出缓存，路径为 cache_dir/model_key/key.npz，以float16压缩保存
+    修改阈值或重新导出时可以跳过网络计算
+    Args:
+        cache_dir (str): 缓存文件夹
+        model_key (str): 模型参数的哈希
+    """
+    def __init__(self, cache_dir, model_key):
+        self.cache_dir = os.path.join(cache_dir, model_key)
+        if os.path.exists(self.cache_dir) == False:
+            os.makedirs(self.cache_dir)
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, key + '.npz')
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data['logits'].astype('float32')
+
+    def put(self, key, logits):
+        path = os.path.join(self.cache_dir, key + '.npz')
+        tmp_path = os.path.join(self.cache_dir, '.tmp_' + key + '.npz')
+        np.savez_compressed(tmp_path, logits=logits.astype('float16'))
+        os.replace(tmp_path, path)
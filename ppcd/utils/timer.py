@@ -1,4 +1,5 @@
 import time
+import numpy as np
 
 
 class TimeAverager(object):
@@ -39,4 +40,74 @@ def calculate_eta(remaining_step, speed):
     for i in range(2, -1, -1):
         arr.append(int(remaining_time / 60**i))
         remaining_time %= 60**i
-    return result.format(*arr)
\ No newline at end of file
+    return result.format(*arr)
+
+
+class StageTimer(object):
+    """
+    记录每一步中各个阶段（数据等待、拷贝、前向、损失、反向、优化、日志等）的耗时
+    Args:
+        enable (bool): 是否开启，关闭时所有操作直接返回，默认为True
+        sync_fn (function/None): 计时前调用的同步函数（如GPU上的paddle.device.cuda.synchronize），默认为None
+        percentiles (list): 统计的百分位数，默认为[50, 95, 99]
+    """
+    def __init__(self, enable=True, sync_fn=None, percentiles=[50, 95, 99]):
+        self.enable = enable
+        self.sync_fn = sync_fn
+        self.percentiles = percentiles
+        self.records = {}
+        self.last_time = None
+
+    def reset(self):
+        self.records = {}
+
+    def start(self):
+        if not self.enable:
+            return
+        if self.sync_fn is not None:
+            self.sync_fn()
+        self.last_time = time.time()
+
+    def record(self, stage, usetime):
+        if not self.enable:
+            return
+        if stage not in self.records:
+            self.records[stage] = []
+        self.records[stage].append(usetime)
+
+    def tick(self, stage):
+        # 记录从上一次start/tick到现在的耗时
+        if not self.enable:
+            return
+        if self.sync_fn is not None:
+            self.sync_fn()
+        now = time.time()
+        self.record(stage, now - self.last_time)
+        self.last_time = now
+
+    def summary(self):
+        results = {}
+        for stage, times in self.records.items():
+            times = np.array(times)
+            result = {'mean': float(np.mean(times)), 'total': float(np.sum(times))}
+            for p in self.percentiles:
+                result['p' + str(p)] = float(np.percentile(times, p))
+            results[stage] = result
+        return results
+
+    def log(self, writer=None, step=None):
+        if not self.enable or self.records == {}:
+            return
+        results = self.summary()
+        step_total = sum([result['total'] for result in results.values()])
+        infos = []
+        for stage, result in results.items():
+            rate = result['total'] / (step_total + 1e-12) * 100
+            infos.append("{}: {:.2f}ms({:.1f}%)".format(stage, result['mean'] * 1000, rate) + \
+                ''.join([", p{}: {:.2f}ms".format(p, result['p' + str(p)] * 1000) for p in self.percentiles]))
+            if writer is not None:
+                writer.add_scalar(tag=("time/" + stage), step=step, value=result['mean'])
+                for p in self.percentiles:
+                    writer.add_scalar(tag=("time/" + stage + "_p" + str(p)), step=step, \
+                                      value=result['p' + str(p)])
+        print("[Timer] " + "; ".join(infos))
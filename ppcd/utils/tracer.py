@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import threading
+
+
+_TRACER = None  # 当前的记录器，为None时不记录
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    def __init__(self, tracer, name, cat):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.tracer.add(self.name, self.cat, self.start, time.perf_counter())
+
+
+class Tracer(object):
+    """
+    记录各个阶段的时间段，导出为Chrome trace event格式（可以在chrome://tracing或Perfetto中查看）
+    """
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def add(self, name, cat, start, end, args=None):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,  # 微秒
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident()
+        }
+        if args is not None:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+
+    def export(self, save_path):
+        with self.lock:
+            events = list(self.events)
+        with open(save_path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def enable_trace():
+    global _TRACER
+    _TRACER = Tracer()
+    return _TRACER
+
+
+def disable_trace():
+    global _TRACER
+    _TRACER = None
+
+
+def is_tracing():
+    return _TRACER is not None
+
+
+def export_trace(save_path):
+    if _TRACER is None:
+        raise RuntimeError('The tracer is not enabled, please call enable_trace first.')
+    _TRACER.export(save_path)
+    print('[Trace] trace saved in: ' + save_path)
+
+
+def trace_span(name, cat='ppcd'):
+    '''
+        记录一个时间段，未开启时返回空的上下文，不产生额外开销
+        用法：with trace_span('read_img'): ...
+    '''
+    if _TRACER is None:
+        return NULL_SPAN
+    return Span(_TRACER, name, cat)
+
+
+def trace_layers(model):
+    '''
+        为网络的每个子层注册前向的hook，记录每个子层前向的时间段，重复调用不会重复注册
+    '''
+    if _TRACER is None or not hasattr(model, 'named_sublayers') or \
+       getattr(model, '_trace_hooks', None) is not None:
+        return
+    starts = {}
+
+    def pre_hook(layer, inputs):
+        if _TRACER is not None:
+            starts[id(layer)] = time.perf_counter()
+
+    def post_hook(layer, inputs, outputs):
+        start = starts.pop(id(layer), None)
+        if _TRACER is not None and start is not None:
+            _TRACER.add(layer.full_name(), 'forward', start, time.perf_counter())
+
+    hooks = []
+    for _, sublayer in model.named_sublayers(include_self=True):
+        hooks.append(sublayer.register_forward_pre_hook(pre_hook))
+        hooks.append(sublayer.register_forward_post_hook(post_hook))
+    model._trace_hooks = hooks